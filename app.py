@@ -1,12 +1,28 @@
 # app.py
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from routers import companies, forms, voice
+from routers import companies, forms, voice, metrics
+from services.tracing_service import RequestTracingMiddleware
+from services.admission_service import AdmissionMiddleware, DeadlineExceeded, deadline_exceeded_handler
+from services.clients import init_clients, close_clients
+from services.prefetch_service import prefetch_scheduler
+from services.audio_upload_service import audio_uploads
 import os
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared Anthropic/OpenAI/Anvil/httpx clients live for the whole process
+    init_clients()
+    yield
+    prefetch_scheduler.shutdown()
+    audio_uploads.shutdown()
+    close_clients()
+
 def create_app() -> FastAPI:
     app = FastAPI(
+        lifespan=lifespan,
         openapi_url="/api/openapi.json",
         docs_url="/api/docs",
         redoc_url="/api/redoc",
@@ -18,6 +34,10 @@ def create_app() -> FastAPI:
     app.include_router(companies.router, prefix="/companies", tags=["Companies"])
     app.include_router(forms.router, prefix="/forms", tags=["Forms"])
     app.include_router(voice.router, prefix="/voice", tags=["Voice"])
+    app.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
+    app.add_exception_handler(DeadlineExceeded, deadline_exceeded_handler)
+    # Per-route-group bulkheads and request deadlines (inside CORS so 503s keep CORS headers)
+    app.add_middleware(AdmissionMiddleware)
     # Allow localhost:3000 or any domain
     app.add_middleware(
         CORSMiddleware,
@@ -27,6 +47,8 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
         expose_headers=["*"]
     )
+    # Request IDs, request durations and slow-request logging
+    app.add_middleware(RequestTracingMiddleware)
 
     # Create static directory if it doesn't exist
     static_dir = os.path.join(os.path.dirname(__file__), "static")
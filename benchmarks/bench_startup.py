@@ -0,0 +1,88 @@
+"""
+Startup and per-request client overhead benchmark.
+
+Measures:
+  1) cold start: time to `import app` in a fresh interpreter (median of N runs),
+     with and without the heavy SDKs (anthropic, openai, python_anvil) preloaded
+     the way the routers used to import them
+  2) per-request overhead: constructing a new Anthropic/Anvil client per call
+     (old behaviour) vs reusing the shared client from services.clients
+
+Run from the backend directory:
+    python benchmarks/bench_startup.py [--runs 10] [--iterations 200]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_APP = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+IMPORT_APP_EAGER = (
+    "import time; t = time.perf_counter(); "
+    "import anthropic, openai, python_anvil.api; import app; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def _cold_start(code: str, runs: int) -> float:
+    samples = []
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "0"}
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        )
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def _per_call(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per cold-start measurement")
+    parser.add_argument("--iterations", type=int, default=200, help="client constructions per overhead measurement")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("ANTHROPIC_API_KEY", "bench")
+    os.environ.setdefault("ANVIL_API_KEY", "bench")
+
+    lazy = _cold_start(IMPORT_APP, args.runs)
+    eager = _cold_start(IMPORT_APP_EAGER, args.runs)
+    print("Cold start (import app, median)")
+    print(f"  eager SDK imports : {eager * 1000:8.1f} ms")
+    print(f"  lazy SDK imports  : {lazy * 1000:8.1f} ms")
+    print(f"  saved             : {(eager - lazy) * 1000:8.1f} ms")
+
+    from anthropic import Anthropic
+    from python_anvil.api import Anvil
+    from services.clients import get_anthropic_client, get_anvil_client, close_clients
+
+    per_request_anthropic = _per_call(lambda: Anthropic(api_key="bench"), args.iterations)
+    per_request_anvil = _per_call(lambda: Anvil(api_key="bench"), args.iterations)
+    shared_anthropic = _per_call(get_anthropic_client, args.iterations)
+    shared_anvil = _per_call(get_anvil_client, args.iterations)
+    close_clients()
+
+    print("Per-request client overhead (mean)")
+    print(f"  Anthropic new client : {per_request_anthropic * 1e6:10.1f} us")
+    print(f"  Anthropic shared     : {shared_anthropic * 1e6:10.1f} us")
+    print(f"  Anvil new client     : {per_request_anvil * 1e6:10.1f} us")
+    print(f"  Anvil shared         : {shared_anvil * 1e6:10.1f} us")
+    print("Note: shared clients also reuse keep-alive connections, which removes a TLS")
+    print("handshake per call; that saving shows up in the harper_stage_duration_seconds")
+    print("histograms (extraction_llm_call, anvil_fill) rather than here.")
+
+
+if __name__ == "__main__":
+    main()
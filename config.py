@@ -1,5 +1,6 @@
 # backend/config.py
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -29,4 +30,93 @@ RETOOL_COMPANY_LIST_URL = os.getenv("RETOOL_COMPANY_LIST_URL", "https://tatch.re
 RETOOL_COMPANY_MEMORY_URL = os.getenv("RETOOL_COMPANY_MEMORY_URL", "https://tatch.retool.com/url/company-memory")
 
 # property something called applicant etc
-# part time employees
\ No newline at end of file
+# part time employees
+
+# Observability
+# Requests slower than this (in milliseconds) are logged with their per-stage breakdown; 0 disables
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "0"))
+
+# Shared clients
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+# Build the Anthropic/OpenAI/Anvil clients in the background right after startup
+PREWARM_CLIENTS = os.getenv("PREWARM_CLIENTS", "false").lower() in ("1", "true", "yes")
+
+# Extraction cache and speculative prefetch
+EXTRACTION_CACHE_TTL_SECONDS = float(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", "900"))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "256"))
+# When enabled, GET /companies/{id}/memory starts the Claude extraction in the background
+EXTRACTION_PREFETCH_ENABLED = os.getenv("EXTRACTION_PREFETCH_ENABLED", "false").lower() in ("1", "true", "yes")
+PREFETCH_MAX_WORKERS = int(os.getenv("PREFETCH_MAX_WORKERS", "2"))
+PREFETCH_MAX_PENDING = int(os.getenv("PREFETCH_MAX_PENDING", "8"))
+# Global budget of LLM tokens prefetches may spend per rolling hour
+PREFETCH_TOKEN_BUDGET_PER_HOUR = int(os.getenv("PREFETCH_TOKEN_BUDGET_PER_HOUR", "500000"))
+
+# Extraction repair
+# Follow-up Claude calls for fields missing/invalid in the first extraction; 0 disables repair
+EXTRACTION_REPAIR_ROUNDS = int(os.getenv("EXTRACTION_REPAIR_ROUNDS", "1"))
+
+# Extraction provenance (incremental re-extraction when memory changes)
+# Companies whose per-field sources are kept in memory
+EXTRACTION_PROVENANCE_MAX_COMPANIES = int(os.getenv("EXTRACTION_PROVENANCE_MAX_COMPANIES", "500"))
+
+# LLM scheduler (shared Anthropic rate-limit budget)
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "50"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "80000"))
+LLM_MAX_CONCURRENT_INTERACTIVE = int(os.getenv("LLM_MAX_CONCURRENT_INTERACTIVE", "8"))
+LLM_MAX_CONCURRENT_STANDARD = int(os.getenv("LLM_MAX_CONCURRENT_STANDARD", "4"))
+LLM_MAX_CONCURRENT_BACKGROUND = int(os.getenv("LLM_MAX_CONCURRENT_BACKGROUND", "2"))
+# Fraction of the request/token budget background calls must leave untouched
+LLM_BACKGROUND_RESERVE = float(os.getenv("LLM_BACKGROUND_RESERVE", "0.25"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+# Upper bound for a single Claude/Whisper call (shortened to the request's remaining deadline)
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+
+# Bulkheads (per route group: concurrent requests, queued requests, request deadline)
+# Keep the concurrency sum below the 40-thread sync route threadpool so cheap routes never starve
+BULKHEAD_LLM_CONCURRENCY = int(os.getenv("BULKHEAD_LLM_CONCURRENCY", "8"))
+BULKHEAD_LLM_QUEUE = int(os.getenv("BULKHEAD_LLM_QUEUE", "16"))
+BULKHEAD_LLM_DEADLINE_SECONDS = float(os.getenv("BULKHEAD_LLM_DEADLINE_SECONDS", "90"))
+BULKHEAD_TRANSCRIBE_CONCURRENCY = int(os.getenv("BULKHEAD_TRANSCRIBE_CONCURRENCY", "4"))
+BULKHEAD_TRANSCRIBE_QUEUE = int(os.getenv("BULKHEAD_TRANSCRIBE_QUEUE", "8"))
+BULKHEAD_TRANSCRIBE_DEADLINE_SECONDS = float(os.getenv("BULKHEAD_TRANSCRIBE_DEADLINE_SECONDS", "120"))
+BULKHEAD_DEFAULT_CONCURRENCY = int(os.getenv("BULKHEAD_DEFAULT_CONCURRENCY", "24"))
+BULKHEAD_DEFAULT_QUEUE = int(os.getenv("BULKHEAD_DEFAULT_QUEUE", "100"))
+BULKHEAD_DEFAULT_DEADLINE_SECONDS = float(os.getenv("BULKHEAD_DEFAULT_DEADLINE_SECONDS", "20"))
+# Longest a request waits in a bulkhead queue before getting a 503
+BULKHEAD_QUEUE_TIMEOUT_SECONDS = float(os.getenv("BULKHEAD_QUEUE_TIMEOUT_SECONDS", "5"))
+
+# Company list cache
+COMPANY_LIST_TTL_SECONDS = float(os.getenv("COMPANY_LIST_TTL_SECONDS", "300"))
+# After a failed refresh, the stale list is served this long before Retool is tried again
+COMPANY_LIST_RETRY_SECONDS = float(os.getenv("COMPANY_LIST_RETRY_SECONDS", "30"))
+
+# Response compression (memory endpoint)
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+
+# Anvil form templates; ACORD 125 defaults to the template in services/anvil_api.py
+ANVIL_TEMPLATE_ACORD_125 = os.getenv("ANVIL_TEMPLATE_ACORD_125")
+ANVIL_TEMPLATE_ACORD_126 = os.getenv("ANVIL_TEMPLATE_ACORD_126")
+ANVIL_TEMPLATE_ACORD_140 = os.getenv("ANVIL_TEMPLATE_ACORD_140")
+ANVIL_TEMPLATE_CARRIER_SUPPLEMENTAL = os.getenv("ANVIL_TEMPLATE_CARRIER_SUPPLEMENTAL")
+# Concurrent Anvil fills when generating several forms at once
+ANVIL_MAX_CONCURRENT_FILLS = int(os.getenv("ANVIL_MAX_CONCURRENT_FILLS", "4"))
+
+# Chunked audio uploads (resumable long recordings)
+AUDIO_UPLOAD_DIR = os.getenv("AUDIO_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "harper_audio_uploads"))
+AUDIO_CHUNK_MAX_BYTES = int(os.getenv("AUDIO_CHUNK_MAX_BYTES", str(8 * 1024 * 1024)))
+AUDIO_UPLOAD_MAX_BYTES = int(os.getenv("AUDIO_UPLOAD_MAX_BYTES", str(500 * 1024 * 1024)))
+# Upper bound for total_chunks / chunk indexes
+AUDIO_UPLOAD_MAX_CHUNKS = int(os.getenv("AUDIO_UPLOAD_MAX_CHUNKS", "10000"))
+# Uploads with no activity (create, chunk, finalize) for this long are deleted
+AUDIO_UPLOAD_TTL_SECONDS = float(os.getenv("AUDIO_UPLOAD_TTL_SECONDS", "86400"))
+# Audio up to this size goes to Whisper as is; larger files are segmented with ffmpeg
+AUDIO_DIRECT_TRANSCRIBE_MAX_BYTES = int(os.getenv("AUDIO_DIRECT_TRANSCRIBE_MAX_BYTES", str(4 * 1024 * 1024)))
+# Segment length; 10 minutes of 16 kHz mono 64 kbps MP3 is ~5 MB, well under Whisper's 25 MB limit
+AUDIO_SEGMENT_SECONDS = int(os.getenv("AUDIO_SEGMENT_SECONDS", "600"))
+TRANSCRIBE_MAX_WORKERS = int(os.getenv("TRANSCRIBE_MAX_WORKERS", "4"))
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+# Finalize runs in the background (clients poll the upload); concurrent jobs and each job's deadline
+AUDIO_FINALIZE_MAX_JOBS = int(os.getenv("AUDIO_FINALIZE_MAX_JOBS", "2"))
+AUDIO_FINALIZE_DEADLINE_SECONDS = float(os.getenv("AUDIO_FINALIZE_DEADLINE_SECONDS", "1800"))
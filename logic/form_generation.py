@@ -3,10 +3,24 @@ Business/domain logic for form generation and updating.
 """
 from services.anvil_api import fill_pdf_with_anvil
 from services.clean_memory_service import clean_memory
-from services.parse_memory_service import parse_memory_data
+from services.parse_memory_service import parse_memory_data, peek_extraction, DEFAULT_FIELD_MAPPING
+from services.clients import get_anthropic_client
+from services.llm_json import extract_json, validate_fields
+from services.llm_scheduler import llm_scheduler, estimate_tokens, message_tokens, INTERACTIVE
+from services.admission_service import DeadlineExceeded, upstream_timeout
+from services.tracing_service import trace_span, log_error, record_llm_usage
+from logic.form_templates import (
+    ACORD_125,
+    FormTemplate,
+    build_anvil_payload,
+    get_template,
+    union_field_mapping,
+)
+import contextvars
 import os
-from typing import Dict, Any
-from config import ANVIL_TEMPLATE_EID
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+from config import ANVIL_MAX_CONCURRENT_FILLS, LLM_TIMEOUT_SECONDS
 
 def generate_form(company_id: int, memory_data: Dict[str, Any]) -> str:
     """
@@ -15,124 +29,76 @@ def generate_form(company_id: int, memory_data: Dict[str, Any]) -> str:
     """
     # Clean and extract all fields from memory data using Claude
     # Note: parse_memory_data already calls clean_memory internally
-    parsed_data = parse_memory_data(memory_data)
-    
-    # Prepare data structure for Anvil
-    data_for_anvil = {
-        "title": "Acord 125",
-        "fontSize": 10,
-        "textColor": "#333333",
-        "data": {
-            "billingPlanForPolicyIsDirect": parsed_data.get("billingPlanForPolicyIsDirect"),
-            "applicantIsLLC": parsed_data.get("applicantIsLLC"),
-            "dateOfApplication": parsed_data.get("dateOfApplication"),
-            "agency": parsed_data.get("agency"),
-            "carrier": parsed_data.get("carrier"),
-            "naicCode": parsed_data.get("naicCode"),
-            "companyPolicyOrProgramName": parsed_data.get("companyPolicyOrProgramName"),
-            "programCode": parsed_data.get("programCode"),
-            "agencyCustomerId": parsed_data.get("agencyCustomerId"),
-            "hasBusinessOwnersAttachedSections": parsed_data.get("hasBusinessOwnersAttachedSections"),
-            "hasCommercialGeneralLiabilitySectionsAttached": parsed_data.get("hasCommercialGeneralLiabilitySectionsAttached"),
-            "paymentPlan": parsed_data.get("paymentPlan"),
-            "methodOfPayment": parsed_data.get("methodOfPayment"),
-            "audit1": parsed_data.get("audit1"),
-            "applicantName1": {
-                "firstName": parsed_data.get("applicantName1", {}).get("firstName"),
-                "mi": parsed_data.get("applicantName1", {}).get("mi"),
-                "lastName": parsed_data.get("applicantName1", {}).get("lastName")
-            },
-            "glCode1": parsed_data.get("glCode1"),
-            "sic1": parsed_data.get("sic1"),
-            "naics1": parsed_data.get("naics1"),
-            "feinOrSocSec1": parsed_data.get("feinOrSocSec1"),
-            "websiteAddress": {
-                "street1": parsed_data.get("websiteAddress", {}).get("street1"),
-                "street2": parsed_data.get("websiteAddress", {}).get("street2"),
-                "city": parsed_data.get("websiteAddress", {}).get("city"),
-                "state": parsed_data.get("websiteAddress", {}).get("state"),
-                "zip": parsed_data.get("websiteAddress", {}).get("zip"),
-                "country": parsed_data.get("websiteAddress", {}).get("country")
-            },
-            "contactInformationPrimary1": parsed_data.get("contactInformationPrimary1"),
-            "contactInformationSecondary1": parsed_data.get("contactInformationSecondary1"),
-            "premisesZipcode": {
-                "street1": parsed_data.get("premisesZipcode", {}).get("street1"),
-                "street2": parsed_data.get("premisesZipcode", {}).get("street2"),
-                "city": parsed_data.get("premisesZipcode", {}).get("city"),
-                "state": parsed_data.get("premisesZipcode", {}).get("state"),
-                "zip": parsed_data.get("premisesZipcode", {}).get("zip"),
-                "country": parsed_data.get("premisesZipcode", {}).get("country")
-            },
-            "agencyCustomerId1": parsed_data.get("agencyCustomerId1"),
-            "location": parsed_data.get("location"),
-            "numberOfFullTimeEmployees": parsed_data.get("numberOfFullTimeEmployees"),
-            "building": parsed_data.get("building"),
-            "county": {
-                "street1": parsed_data.get("county", {}).get("street1"),
-                "street2": parsed_data.get("county", {}).get("street2"),
-                "city": parsed_data.get("county", {}).get("city"),
-                "state": parsed_data.get("county", {}).get("state"),
-                "zip": parsed_data.get("county", {}).get("zip"),
-                "country": parsed_data.get("county", {}).get("country")
-            },
-            "location1": parsed_data.get("location1"),
-            "partTimeEmployeesNumber": parsed_data.get("partTimeEmployeesNumber"),
-            "building1": parsed_data.get("building1"),
-            "annualRevenues": parsed_data.get("annualRevenues"),
-            "location2": parsed_data.get("location2"),
-            "building2": parsed_data.get("building2"),
-            "location3": parsed_data.get("location3"),
-            "building3": parsed_data.get("building3"),
-            "descriptionOfPrimaryOperations": parsed_data.get("descriptionOfPrimaryOperations"),
-            "agencyCustomerId2": parsed_data.get("agencyCustomerId2"),
-            "priorCarrierForGeneralLiability": parsed_data.get("priorCarrierForGeneralLiability"),
-            "priorCarrierForAutomobile": parsed_data.get("priorCarrierForAutomobile"),
-            "priorCarrierForProperty": parsed_data.get("priorCarrierForProperty"),
-            "agencyCustomerId3": parsed_data.get("agencyCustomerId3"),
-            "producersName": parsed_data.get("producersName"),
-            "depositAmount": parsed_data.get("depositAmount"),
-            "minimumPremium": parsed_data.get("minimumPremium"),
-            "policyPremium": parsed_data.get("policyPremium"),
-            "hasEquipmentFloaterSectionsAttached": parsed_data.get("hasEquipmentFloaterSectionsAttached"),
-            "hasElectronicDataProcSectionAttached": parsed_data.get("hasElectronicDataProcSectionAttached"),
-            "hasAccountsReceivableAttached": parsed_data.get("hasAccountsReceivableAttached"),
-            "hasBoilerAndMachinery": parsed_data.get("hasBoilerAndMachinery"),
-            "hasBusinessAuto": parsed_data.get("hasBusinessAuto"),
-            "hasPropertySectionsAttached": parsed_data.get("hasPropertySectionsAttached"),
-            "hasTruckersMotorCarrierSectionsAttached": parsed_data.get("hasTruckersMotorCarrierSectionsAttached"),
-            "hasTransportationSectionsAttached": parsed_data.get("hasTransportationSectionsAttached"),
-            "policyNumber": parsed_data.get("policyNumber"),
-            "agencyContactName": parsed_data.get("agencyContactName"),
-            "agencyContactPhone": parsed_data.get("agencyContactPhone"),
-            "agencyEmailAddress": parsed_data.get("agencyEmailAddress"),
-            "proposedEffectiveDate": parsed_data.get("proposedEffectiveDate"),
-            "billingPlanIsAgency": parsed_data.get("billingPlanIsAgency"),
-            "field16f996340b2011f083dfd3961689d753": parsed_data.get("field16f996340b2011f083dfd3961689d753"),
-            "applicantIsNotForProfit": parsed_data.get("applicantIsNotForProfit"),
-            "applicantContactName": parsed_data.get("applicantContactName"),
-            "applicantPhoneNumber": parsed_data.get("applicantPhoneNumber"),
-            "applicantEmailAddress": parsed_data.get("applicantEmailAddress"),
-            "premisesState": parsed_data.get("premisesState"),
-            "hasFormalSafetyProgram": parsed_data.get("hasFormalSafetyProgram"),
-            "followsOsha": parsed_data.get("followsOsha"),
-            "hasSafetyPosition": parsed_data.get("hasSafetyPosition")
+    with trace_span("extraction"):
+        # None if nothing could be extracted; fill the form with blanks rather than crash
+        parsed_data = parse_memory_data(memory_data, company_id=company_id) or {}
+    
+    values, _ = validate_fields(parsed_data, ACORD_125.field_mapping)
+    return _fill_and_save(ACORD_125, values, f"form_{company_id}.pdf")
+
+def generate_forms(company_id: int, memory_data: Dict[str, Any], template_names: List[str]) -> Dict[str, Dict[str, str]]:
+    """
+    Fills several form templates for one company from a single extraction pass.
+    
+    The union of the templates' fields is extracted once (fields already cached for
+    the ACORD 125, e.g. by a prefetch, are reused), then the PDFs are filled
+    concurrently. Returns {"pdfs": {name: url}, "errors": {name: message}}.
+    Raises KeyError/ValueError for unknown or unconfigured templates.
+    """
+    templates = [get_template(name) for name in dict.fromkeys(template_names)]
+    union = union_field_mapping(templates)
+    
+    with trace_span("extraction"):
+        values: Dict[str, Any] = {}
+        remaining = union
+        if any(key in DEFAULT_FIELD_MAPPING for key in union):
+            cached = peek_extraction(memory_data, company_id=company_id)
+            if cached is not None:
+                values, _ = validate_fields(cached, DEFAULT_FIELD_MAPPING)
+                values = {key: value for key, value in values.items() if key in union}
+                remaining = {key: desc for key, desc in union.items() if key not in DEFAULT_FIELD_MAPPING}
+        if remaining:
+            parsed_data = parse_memory_data(memory_data, field_mapping=remaining, company_id=company_id) or {}
+            extracted, _ = validate_fields(parsed_data, remaining)
+            values.update(extracted)
+    
+    pdfs: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(len(templates), ANVIL_MAX_CONCURRENT_FILLS))) as pool:
+        # copy_context keeps the request's trace (request ID, stage breakdown) in the worker threads
+        futures = {
+            template.name: pool.submit(
+                contextvars.copy_context().run,
+                _fill_and_save, template, values, f"form_{company_id}_{template.name}.pdf",
+            )
+            for template in templates
         }
-    }
+        for name, future in futures.items():
+            try:
+                pdfs[name] = future.result()
+            except Exception as e:
+                log_error(f"fill_{name}", e)
+                errors[name] = str(e)
+    return {"pdfs": pdfs, "errors": errors}
 
+def _fill_and_save(template: FormTemplate, values: Dict[str, Any], filename: str) -> str:
+    """
+    Fills `template` with Anvil, writes the PDF to static/forms/ and returns its URL path.
+    """
+    data_for_anvil = build_anvil_payload(template, values)
+    
     # Get PDF bytes from Anvil
-    pdf_bytes = fill_pdf_with_anvil(data_for_anvil)
+    pdf_bytes = fill_pdf_with_anvil(data_for_anvil, template.template_id)
     
-    # Create a unique filename for this company's form
-    filename = f"form_{company_id}.pdf"
     filepath = os.path.join("static", "forms", filename)
     
     # Ensure the directory exists
     os.makedirs(os.path.dirname(filepath), exist_ok=True)
     
     # Save the PDF
-    with open(filepath, "wb") as f:
-        f.write(pdf_bytes)
+    with trace_span("pdf_write"):
+        with open(filepath, "wb") as f:
+            f.write(pdf_bytes)
     
     # Return the URL path to the saved PDF
     return f"/static/forms/{filename}"
@@ -142,27 +108,23 @@ def update_form_logic(form_data, update_command: str):
     Process natural language commands to update form fields.
     Uses Claude to interpret the command and map it to the correct field.
     """
-    from anthropic import Anthropic
-    import os
     import json
     
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if not api_key:
-        raise ValueError("ANTHROPIC_API_KEY environment variable not set")
-    
-    # Initialize Anthropic client
-    client = Anthropic(api_key=api_key)
+    # Shared Anthropic client (raises ValueError if ANTHROPIC_API_KEY is not set)
+    client = get_anthropic_client()
     
     # Get all available fields from form_data
     available_fields = list(form_data.keys())
     
     # Construct the prompt for Claude
+    with trace_span("update_prompt_build"):
+        form_json = json.dumps(form_data, indent=2)
     prompt = f"""
     You are an expert at updating insurance form data based on natural language commands.
     
     Here is the current form data:
     ```json
-    {json.dumps(form_data, indent=2)}
+    {form_json}
     ```
     
     The user wants to update this form with the following command:
@@ -182,37 +144,163 @@ def update_form_logic(form_data, update_command: str):
     
     try:
         # Call Claude API
-        message = client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=2000,
-            temperature=0,
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            system="You are an expert at updating insurance form data. You should only return valid JSON that matches the form data structure exactly."
-        )
+        # Edits are interactive: they jump ahead of generation and background extractions
+        with trace_span("update_llm_call"):
+            message = llm_scheduler.call(
+                INTERACTIVE,
+                estimate_tokens(prompt, 2000),
+                lambda: client.messages.create(
+                    model="claude-3-sonnet-20240229",
+                    max_tokens=2000,
+                    temperature=0,
+                    timeout=upstream_timeout(LLM_TIMEOUT_SECONDS),
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ],
+                    system="You are an expert at updating insurance form data. You should only return valid JSON that matches the form data structure exactly."
+                ),
+                usage_tokens=message_tokens,
+            )
+        record_llm_usage("update", prompt, message)
         
-        content = message.content[0].text
-        
-        # Extract the JSON part
-        if "```json" in content:
-            json_content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            json_content = content.split("```")[1].strip()
-        else:
-            json_content = content.strip()
-        
-        # Parse the extracted JSON
-        updated_form_data = json.loads(json_content)
+        with trace_span("update_json_extract"):
+            # Tolerates fences and trailing text; a truncated form would drop fields, so reject it
+            updated_form_data = extract_json(message.content[0].text)
+        if updated_form_data is None or message.stop_reason == "max_tokens":
+            raise ValueError("Claude returned no complete JSON form")
         
         return updated_form_data
     
+    except DeadlineExceeded:
+        # Out of time: a 504 beats silently returning the unchanged form
+        raise
     except Exception as e:
-        print(f"Error with Claude API: {str(e)}")
+        log_error("update", e)
         # Fallback to simple logic if Claude fails
         if "deductible" in update_command.lower():
             form_data["deductible"] = "$5000"
         return form_data
+
+def _form_leaf_values(form_data: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """
+    Flattens a form into {"parent.child": value} for every non-dict value.
+    """
+    values: Dict[str, Any] = {}
+    for key, value in form_data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(_form_leaf_values(value, f"{path}."))
+        else:
+            values[path] = value
+    return values
+
+def resolve_form_commands(form_data: Dict[str, Any], commands: List[str]) -> List[Dict[str, Any]]:
+    """
+    Turns one or more natural language edit commands into field operations with a
+    single Claude call. A command may contain several edits ("set city to Austin and
+    revenue to 2 million"); each becomes its own operation.
+    
+    Returns [{"path": "premisesZipcode.city", "value": "Austin", "command": 0}, ...],
+    where `command` is the index of the command the operation came from. Operations
+    on unknown paths or with non-scalar values are dropped.
+    Raises ValueError if Claude's answer can't be used.
+    """
+    import json
+    
+    leaf_values = _form_leaf_values(form_data)
+    client = get_anthropic_client()
+    
+    with trace_span("update_batch_prompt_build"):
+        form_json = json.dumps(form_data, indent=2)
+        command_list = "\n".join(f"{i}. {command}" for i, command in enumerate(commands))
+    prompt = f"""
+    You are an expert at updating insurance form data based on natural language commands.
+    
+    Here is the current form data:
+    ```json
+    {form_json}
+    ```
+    
+    The user gave these numbered commands. A single command may contain several edits:
+    {command_list}
+    
+    Translate every edit into an operation that sets one field. Use dotted paths for nested
+    fields (e.g. "premisesZipcode.city"). These are the only valid paths:
+    {', '.join(leaf_values)}
+    
+    If the command is ambiguous or unclear, make your best judgment based on common insurance terminology.
+    Use the same value types as the current form (strings, numbers, true/false, null).
+    
+    Your response should be ONLY a JSON object with this structure:
+    {{"operations": [{{"command": 0, "path": "premisesZipcode.city", "value": "Austin"}}]}}
+    """
+    
+    with trace_span("update_batch_llm_call"):
+        message = llm_scheduler.call(
+            INTERACTIVE,
+            estimate_tokens(prompt, 1000),
+            lambda: client.messages.create(
+                model="claude-3-sonnet-20240229",
+                max_tokens=1000,
+                temperature=0,
+                timeout=upstream_timeout(LLM_TIMEOUT_SECONDS),
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                system="You are an expert at updating insurance form data. You should only return valid JSON that matches the requested structure exactly."
+            ),
+            usage_tokens=message_tokens,
+        )
+    record_llm_usage("update_batch", prompt, message)
+    
+    with trace_span("update_batch_json_extract"):
+        result = extract_json(message.content[0].text)
+    if result is None or not isinstance(result.get("operations"), list):
+        raise ValueError("Claude returned no operations")
+    
+    operations = []
+    for op in result["operations"]:
+        if not isinstance(op, dict) or op.get("path") not in leaf_values:
+            log_error("update_batch", f"Dropping operation on unknown path: {op}")
+            continue
+        if not isinstance(op.get("value"), (str, int, float, bool, type(None))):
+            log_error("update_batch", f"Dropping operation with non-scalar value: {op}")
+            continue
+        command = op.get("command")
+        operations.append({
+            "path": op["path"],
+            "value": op["value"],
+            "command": command if isinstance(command, int) else None,
+        })
+    return operations
+
+def apply_form_operations(form_data: Dict[str, Any], operations: List[Dict[str, Any]]):
+    """
+    Applies set-field operations to a copy of `form_data`.
+    Returns the updated form and the combined diff {path: {"old": ..., "new": ...}}
+    (the last operation wins when several target the same path; no-ops are omitted).
+    """
+    import copy
+    
+    updated = copy.deepcopy(form_data)
+    old_values = _form_leaf_values(form_data)
+    for op in operations:
+        parts = op["path"].split(".")
+        container = updated
+        for part in parts[:-1]:
+            container = container.setdefault(part, {})
+        container[parts[-1]] = op["value"]
+    
+    new_values = _form_leaf_values(updated)
+    diff = {
+        path: {"old": old_values.get(path), "new": new_values[path]}
+        for path in dict.fromkeys(op["path"] for op in operations)
+        if old_values.get(path) != new_values[path]
+    }
+    return updated, diff
@@ -0,0 +1,183 @@
+"""
+Registry of the PDF forms we can fill with Anvil.
+
+Each template pairs an Anvil template ID with the fields it needs, as a field
+mapping in the same format parse_memory_data takes ("parent.child" keys map
+to nested values; keys are the Anvil field aliases). Forms share most
+applicant/location fields, so filling several forms for one company extracts
+the union of their fields in a single pass.
+
+Template IDs come from the environment; a template without one is listed but
+can't be filled. The ACORD 125 falls back to the built-in DEFAULT_TEMPLATE_ID.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import (
+    ANVIL_TEMPLATE_ACORD_125,
+    ANVIL_TEMPLATE_ACORD_126,
+    ANVIL_TEMPLATE_ACORD_140,
+    ANVIL_TEMPLATE_CARRIER_SUPPLEMENTAL,
+)
+from services.anvil_api import DEFAULT_TEMPLATE_ID
+from services.llm_json import nest_fields
+from services.parse_memory_service import DEFAULT_FIELD_MAPPING
+
+
+@dataclass(frozen=True)
+class FormTemplate:
+    name: str
+    title: str
+    template_id: Optional[str]
+    field_mapping: Dict[str, str]
+
+    @property
+    def available(self) -> bool:
+        return bool(self.template_id)
+
+
+# Fields most supplemental forms repeat from the ACORD 125
+_APPLICANT_FIELDS = {
+    key: DEFAULT_FIELD_MAPPING[key]
+    for key in (
+        "applicantName1.firstName",
+        "applicantName1.mi",
+        "applicantName1.lastName",
+        "agency",
+        "agencyCustomerId",
+        "carrier",
+        "naicCode",
+        "policyNumber",
+        "proposedEffectiveDate",
+        "dateOfApplication",
+    )
+}
+
+_PREMISES_FIELDS = {
+    key: description
+    for key, description in DEFAULT_FIELD_MAPPING.items()
+    if key.startswith("premisesZipcode.") or key in ("premisesState", "location", "building")
+}
+
+ACORD_125 = FormTemplate(
+    name="acord_125",
+    title="Acord 125",
+    template_id=ANVIL_TEMPLATE_ACORD_125 or DEFAULT_TEMPLATE_ID,
+    field_mapping=DEFAULT_FIELD_MAPPING,
+)
+
+ACORD_126 = FormTemplate(
+    name="acord_126",
+    title="Acord 126",
+    template_id=ANVIL_TEMPLATE_ACORD_126,
+    field_mapping={
+        **_APPLICANT_FIELDS,
+        "descriptionOfPrimaryOperations": DEFAULT_FIELD_MAPPING["descriptionOfPrimaryOperations"],
+        "annualRevenues": DEFAULT_FIELD_MAPPING["annualRevenues"],
+        "glCode1": DEFAULT_FIELD_MAPPING["glCode1"],
+        "generalAggregateLimit": "The general liability general aggregate limit",
+        "productsCompletedOperationsAggregateLimit": "The products/completed operations aggregate limit",
+        "eachOccurrenceLimit": "The general liability each occurrence limit",
+        "personalAndAdvertisingInjuryLimit": "The personal and advertising injury limit",
+        "damageToRentedPremisesLimit": "The damage to rented premises limit",
+        "medicalExpenseLimit": "The medical expense limit (any one person)",
+        "glDeductible": "The general liability deductible",
+        "premiumBasis": "The premium basis for the GL classification (e.g. gross sales, payroll, area)",
+        "exposure": "The exposure amount for the premium basis",
+        "hasProductsOrCompletedOperations": "Boolean indicating if the applicant has products or completed operations exposure",
+        "usesSubcontractors": "Boolean indicating if the applicant uses subcontractors",
+    },
+)
+
+ACORD_140 = FormTemplate(
+    name="acord_140",
+    title="Acord 140",
+    template_id=ANVIL_TEMPLATE_ACORD_140,
+    field_mapping={
+        **_APPLICANT_FIELDS,
+        **_PREMISES_FIELDS,
+        "constructionType": "The building construction type (e.g. frame, joisted masonry, fire resistive)",
+        "yearBuilt": "The year the building was built",
+        "numberOfStories": "The number of stories of the building",
+        "totalSquareFootage": "The total square footage of the building",
+        "isSprinklered": "Boolean indicating if the building is sprinklered",
+        "roofType": "The roof type/material",
+        "yearRoofReplaced": "The year the roof was last replaced",
+        "protectionClass": "The fire protection class",
+        "buildingLimit": "The building coverage limit",
+        "businessPersonalPropertyLimit": "The business personal property coverage limit",
+        "businessIncomeLimit": "The business income coverage limit",
+        "propertyDeductible": "The property deductible",
+    },
+)
+
+CARRIER_SUPPLEMENTAL = FormTemplate(
+    name="carrier_supplemental",
+    title="Carrier Supplemental",
+    template_id=ANVIL_TEMPLATE_CARRIER_SUPPLEMENTAL,
+    field_mapping={
+        **_APPLICANT_FIELDS,
+        "descriptionOfPrimaryOperations": DEFAULT_FIELD_MAPPING["descriptionOfPrimaryOperations"],
+        "numberOfFullTimeEmployees": DEFAULT_FIELD_MAPPING["numberOfFullTimeEmployees"],
+        "partTimeEmployeesNumber": DEFAULT_FIELD_MAPPING["partTimeEmployeesNumber"],
+        "annualRevenues": DEFAULT_FIELD_MAPPING["annualRevenues"],
+        "hasFormalSafetyProgram": DEFAULT_FIELD_MAPPING["hasFormalSafetyProgram"],
+        "followsOsha": DEFAULT_FIELD_MAPPING["followsOsha"],
+        "yearsInBusiness": "The number of years the applicant has been in business",
+        "hasPriorClaims": "Boolean indicating if the applicant had any claims in the last 5 years",
+        "priorClaimsDescription": "Description of prior claims or losses",
+        "hasCancelledOrNonRenewedPolicy": "Boolean indicating if any policy was cancelled or non-renewed in the last 3 years",
+    },
+)
+
+FORM_TEMPLATES: Dict[str, FormTemplate] = {
+    template.name: template for template in (ACORD_125, ACORD_126, ACORD_140, CARRIER_SUPPLEMENTAL)
+}
+
+
+def get_template(name: str) -> FormTemplate:
+    """
+    Returns the registered template, raising KeyError for unknown names and
+    ValueError for templates without a configured Anvil template ID.
+    """
+    template = FORM_TEMPLATES[name]
+    if not template.available:
+        raise ValueError(f"No Anvil template ID configured for {name}")
+    return template
+
+
+def union_field_mapping(templates: Iterable[FormTemplate]) -> Dict[str, str]:
+    """
+    Combines the field mappings of several templates; shared fields appear once
+    (with the description of the first template that lists them).
+    """
+    union: Dict[str, str] = {}
+    for template in templates:
+        for key, description in template.field_mapping.items():
+            union.setdefault(key, description)
+    return union
+
+
+def build_anvil_payload(template: FormTemplate, values: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Builds the Anvil fill payload for `template` from dotted-key values
+    (missing fields are sent as None).
+    """
+    return {
+        "title": template.title,
+        "fontSize": 10,
+        "textColor": "#333333",
+        "data": nest_fields(values, template.field_mapping),
+    }
+
+
+def describe_templates() -> List[Dict[str, Any]]:
+    return [
+        {
+            "name": template.name,
+            "title": template.title,
+            "available": template.available,
+            "fields": len(template.field_mapping),
+        }
+        for template in FORM_TEMPLATES.values()
+    ]
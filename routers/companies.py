@@ -1,21 +1,82 @@
 # backend/routers/companies.py
-from fastapi import APIRouter
-from services.memory_service import get_companies, get_company_memory
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from config import EXTRACTION_PREFETCH_ENABLED
+from services.company_index_service import (
+    SORT_OPTIONS,
+    company_directory,
+    decode_cursor,
+    encode_cursor,
+    list_etag,
+)
+from services.memory_service import get_company_memory
+from services.response_service import fast_json_response, parse_paths, project_fields
+from services.prefetch_service import prefetch_scheduler
 
 router = APIRouter()
 
 @router.get("/", summary="List available companies")
-def list_companies():
+def list_companies(
+    request: Request,
+    response: Response,
+    q: Optional[str] = Query(None, description="Prefix/fuzzy search over company names and IDs"),
+    sort: str = Query("relevance", description="One of: " + ", ".join(SORT_OPTIONS)),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size; omit for the full list"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    fuzzy: bool = Query(True, description="Include fuzzy name matches when searching"),
+    refresh: bool = Query(False, description="Bypass the cached copy of the Retool list"),
+):
     """
-    Returns a list of available companies from Retool.
+    Returns companies from a cached copy of the Retool list, optionally searched,
+    sorted and paginated. Responses carry an ETag; send it back in If-None-Match
+    to get a 304 when nothing changed.
     """
-    companies = get_companies()
-    return {"companies": companies}
+    if sort not in SORT_OPTIONS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(SORT_OPTIONS)}")
+    try:
+        offset = decode_cursor(cursor) if cursor else 0
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    index = company_directory.get_index(refresh=refresh)
+    etag = list_etag(index, q, sort, limit, offset, fuzzy)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    matches = index.query(q, sort, fuzzy)
+    end = len(matches) if limit is None else offset + limit
+    next_cursor = encode_cursor(end) if end < len(matches) else None
+    return {"companies": matches[offset:end], "total": len(matches), "next_cursor": next_cursor}
 
 @router.get("/{company_id}/memory", summary="Fetch data/memory for a company")
-def fetch_company_memory(company_id: int):
+def fetch_company_memory(
+    request: Request,
+    company_id: int,
+    prefetch: Optional[bool] = None,
+    fields: Optional[str] = Query(
+        None, description="Comma-separated dotted paths to return, e.g. company.json.address,company.name"
+    ),
+):
     """
     Returns the memory/data for a selected company from Retool.
+    When EXTRACTION_PREFETCH_ENABLED is set, also starts the form extraction in the
+    background so /forms/generate finds it warm; `?prefetch=false` opts out. The flag
+    is a hard gate: `?prefetch=true` can't turn prefetching on when it is off.
+    `fields` limits the response to the given paths; large responses are compressed.
     """
     memory_data = get_company_memory(company_id)
-    return {"memory": memory_data}
+    if memory_data and EXTRACTION_PREFETCH_ENABLED and prefetch is not False:
+        # Prefetch always works on the full memory, whatever the projection
+        prefetch_scheduler.schedule(company_id, memory_data)
+    memory_data = project_fields(memory_data, parse_paths(fields))
+    return fast_json_response(request, {"memory": memory_data}, route="company_memory")
+
+@router.delete("/{company_id}/memory/prefetch", summary="Cancel a background extraction")
+def cancel_company_prefetch(company_id: int):
+    """
+    Cancels a queued background extraction for the company (e.g. the user navigated away).
+    """
+    return {"cancelled": prefetch_scheduler.cancel(company_id)}
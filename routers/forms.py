@@ -1,24 +1,33 @@
 # forms.py
 from fastapi import APIRouter, HTTPException, File, UploadFile
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Set
 from collections import defaultdict
-import copy, os
-import openai
-from config import OPENAI_API_KEY
-import tempfile
+import copy, threading
+from services.admission_service import DeadlineExceeded
+from services.audio_upload_service import transcribe_upload
+from services.tracing_service import log_error
+from services.provenance_service import provenance_store
 
 router = APIRouter()
 
-openai.api_key = OPENAI_API_KEY
-
 # Global in-memory store of form states
 # e.g. FORM_STATES[company_id]["current"] => current form data
 #      FORM_STATES[company_id]["history"] => stack of old states
+#      FORM_STATES[company_id]["manual_history"] => per history entry, the manual edits undo restores
+#      FORM_STATES[company_id]["version"] => bumped on every write
+#      FORM_STATES[company_id]["changes"] => recent (version, changed paths or None for "everything")
 FORM_STATES = defaultdict(lambda: {
     "history": [],
-    "current": None
+    "manual_history": [],
+    "current": None,
+    "version": 0,
+    "changes": []
 })
+# Guards FORM_STATES; held only for in-memory reads/writes, never across LLM calls
+FORM_STATES_LOCK = threading.Lock()
+# Versions older than this many writes can't be rebased and get a 409
+MAX_TRACKED_CHANGES = 100
 
 # Pydantic models
 class GenerateFormRequest(BaseModel):
@@ -28,105 +37,261 @@ class GenerateFormRequest(BaseModel):
 class UpdateFormRequest(BaseModel):
     company_id: int
     command: str
+    expected_version: Optional[int] = None
+
+class BatchUpdateFormRequest(BaseModel):
+    company_id: int
+    commands: List[str] = []
+    utterance: Optional[str] = None
+    expected_version: Optional[int] = None
+
+class RefreshFormRequest(BaseModel):
+    company_id: int
+    memory_data: Dict[str, Any]
+
+class GenerateFormsRequest(BaseModel):
+    company_id: int
+    memory_data: Dict[str, Any]
+    templates: List[str] = ["acord_125"]
 
 @router.post("/generate")
 def generate_form_endpoint(request: GenerateFormRequest):
     """
     Generate initial form data from memory_data, store in 'current'.
-    Return a pdf_url or any reference if you generate a PDF file.
+    Return a pdf_url or any reference if you generate a PDF file, plus the form
+    version to send with later batch updates.
     """
     initial_form = generate_form_dict(request.company_id, request.memory_data)
 
     # Clear old data and set new
-    FORM_STATES[request.company_id]["history"].clear()
-    FORM_STATES[request.company_id]["current"] = initial_form
+    with FORM_STATES_LOCK:
+        state = FORM_STATES[request.company_id]
+        state["history"].clear()
+        state["manual_history"].clear()
+        state["current"] = initial_form
+        _record_change(state, None)
+        version = state["version"]
+    # A fresh form starts without manual overrides
+    provenance_store.clear_manual_edits(request.company_id)
 
     # Optionally generate a PDF file for the user
     pdf_url = generate_pdf_and_save(request.company_id, initial_form)
-    return {"pdf_url": pdf_url}
+    return {"pdf_url": pdf_url, "version": version}
 
-@router.post("/update")
-def update_form_endpoint(request: UpdateFormRequest):
+@router.post("/refresh")
+def refresh_form_endpoint(request: RefreshFormRequest):
     """
-    Applies a text-based command to the current form.
-    Moves the old state into 'history' for undo.
+    Rebuilds the current form after the company's memory changed, re-extracting only
+    the fields whose source data changed (or that were empty) and keeping manual edits.
+    The previous form goes onto the undo history. If re-extraction fails the form
+    is left unchanged and the route answers 502.
     """
+    from services.parse_memory_service import refresh_extraction
+
     try:
-        company_id = request.formData.get('company_id')
-        state = FORM_STATES[company_id]
-        if state["current"] is None:
-            raise HTTPException(status_code=400, detail="No form state for this company.")
+        parsed_data, counts = refresh_extraction(request.memory_data, company_id=request.company_id)
+    except ValueError as e:
+        log_error("refresh_form_endpoint", e)
+        raise HTTPException(status_code=502, detail="Could not re-extract the changed fields.")
+    form = generate_form_dict(request.company_id, request.memory_data, parsed_data=parsed_data or {})
 
-        # Save old
-        old_state = copy.deepcopy(state["current"])
-        state["history"].append(old_state)
+    with FORM_STATES_LOCK:
+        state = FORM_STATES[request.company_id]
+        if state["current"] is not None:
+            _push_history(state, state["current"])
+        state["current"] = form
+        _record_change(state, None)
+        return {"updatedFormData": form, "version": state["version"], "fields": counts}
 
-        # Apply command
-        updated_form = apply_command_logic(request.formData, request.updateCommand)
-        state["current"] = updated_form
+@router.get("/templates")
+def list_form_templates():
+    """
+    Lists the form templates that can be generated and whether each is configured.
+    """
+    from logic.form_templates import describe_templates
+    return {"templates": describe_templates()}
 
-        return {"updatedFormData": updated_form}
-    except Exception as e:
-        print(f"Error in update_form_endpoint: {str(e)}")
-        # If there's an error with the state lookup or form not found,
-        # just update the form data directly without state management
-        return {"updatedFormData": apply_command_logic(request.formData, request.updateCommand)}
+@router.post("/generate-batch")
+def generate_forms_endpoint(request: GenerateFormsRequest):
+    """
+    Fills several form templates (e.g. ACORD 125, 126, 140) for one company.
+    Fields shared between templates are extracted once; PDFs are filled concurrently.
+    Returns {"pdfs": {template: url}, "errors": {template: message}}.
+    """
+    from logic.form_generation import generate_forms
+    if not request.templates:
+        raise HTTPException(status_code=400, detail="No templates requested.")
+    try:
+        return generate_forms(request.company_id, request.memory_data, request.templates)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown template: {e.args[0]}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/update")
+def update_form_endpoint(request: UpdateFormRequest):
+    """
+    Applies one text command to the current form; same versioning and
+    conflict handling as /update-batch (pass `expected_version`).
+    """
+    if not request.command.strip():
+        raise HTTPException(status_code=400, detail="No commands given.")
+    return _apply_commands(request.company_id, [request.command], request.expected_version)
+
+@router.post("/update-batch")
+def update_form_batch_endpoint(request: BatchUpdateFormRequest):
+    """
+    Applies several edits in one model call, e.g. a list of commands or one utterance
+    like "set city to Austin, revenue to 2 million and mark OSHA yes".
+    
+    Pass the `version` you last saw as `expected_version`. If other writes landed
+    since then, the edits are rebased onto the latest form when they touch different
+    fields, and rejected with 409 when they overlap. Returns the updated form, the
+    new version and one combined diff.
+    """
+    commands = [command for command in request.commands if command.strip()]
+    if request.utterance and request.utterance.strip():
+        commands.append(request.utterance)
+    if not commands:
+        raise HTTPException(status_code=400, detail="No commands given.")
+    return _apply_commands(request.company_id, commands, request.expected_version)
 
 @router.post("/undo/{company_id}")
 def undo_form_endpoint(company_id: int):
     """
     Reverts the form to the previous version if available.
     """
-    state = FORM_STATES[company_id]
-    if not state["history"]:
-        raise HTTPException(status_code=400, detail="No older version to revert to.")
+    with FORM_STATES_LOCK:
+        state = FORM_STATES[company_id]
+        if not state["history"]:
+            raise HTTPException(status_code=400, detail="No older version to revert to.")
 
-    last_version = state["history"].pop()
-    state["current"] = last_version
-    return {"updatedFormData": last_version}
+        last_version = state["history"].pop()
+        manual_paths, manual_values = state["manual_history"].pop()
+        state["current"] = last_version
+        _record_change(state, None)
+        provenance_store.restore_manual_edits(company_id, manual_paths, manual_values)
+        return {"updatedFormData": last_version, "version": state["version"]}
 
 #
 # Optional: Real /forms/transcribe route for OpenAI Whisper
 #
 @router.post("/transcribe")
-async def transcribe_audio(file: UploadFile = File(...)):
+def transcribe_audio(file: UploadFile = File(...)):
     """
     Example endpoint to accept an audio file and run OpenAI Whisper to transcribe.
     Returns { "transcript": "... recognized text ..." }
+    Runs in the threadpool, off the event loop; long recordings are segmented.
     """
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
-
-        # Transcribe with Whisper
-        resp = openai.Audio.transcribe(
-            model="whisper-1",
-            file=open(tmp_path, "rb")
-        )
-        recognized_text = resp.get("text", "")
-
-        os.remove(tmp_path)
-        return {"transcript": recognized_text}
-
+        return {"transcript": transcribe_upload(file.file, ".webm")}
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        if 'tmp_path' in locals() and os.path.exists(tmp_path):
-            os.remove(tmp_path)
         raise HTTPException(status_code=500, detail=str(e))
 
 #
 # Helper functions
 #
 
-def generate_form_dict(company_id: int, memory_data: Dict[str, Any]) -> Dict[str, Any]:
+def _apply_commands(company_id: int, commands: List[str], expected_version: Optional[int]) -> Dict[str, Any]:
+    """
+    Resolves `commands` against a snapshot of the current form (lock released during
+    the model call), then applies them if none of their paths changed since
+    `expected_version` (default: the snapshot's version). Raises 409 on conflicts.
+    """
+    from logic.form_generation import resolve_form_commands, apply_form_operations
+
+    with FORM_STATES_LOCK:
+        state = FORM_STATES[company_id]
+        if state["current"] is None:
+            raise HTTPException(status_code=400, detail="No form state for this company.")
+        base_form = copy.deepcopy(state["current"])
+        base_version = state["version"]
+    since = base_version if expected_version is None else expected_version
+    if since > base_version:
+        raise HTTPException(status_code=409, detail={"message": "Unknown form version.", "current_version": base_version})
+
+    # Resolve against a snapshot so the lock isn't held during the model call
+    try:
+        operations = resolve_form_commands(base_form, commands)
+    except ValueError as e:
+        log_error("update_form_commands", e)
+        raise HTTPException(status_code=502, detail="Could not interpret the commands.")
+
+    with FORM_STATES_LOCK:
+        state = FORM_STATES[company_id]
+        changed = _paths_changed_since(state, since)
+        conflicts = {op["path"] for op in operations} if changed is None else changed & {op["path"] for op in operations}
+        if conflicts:
+            raise HTTPException(status_code=409, detail={
+                "message": "The form changed since this version.",
+                "current_version": state["version"],
+                "conflicting_paths": sorted(conflicts),
+            })
+        rebased = state["version"] != since
+        updated_form, diff = apply_form_operations(state["current"], operations)
+        if diff:
+            # Undo puts back the manual edits these paths had before
+            _push_history(state, state["current"], company_id, set(diff))
+            state["current"] = updated_form
+            _record_change(state, set(diff))
+            # Refreshes from new memory keep these values
+            provenance_store.record_manual_edits(company_id, {path: change["new"] for path, change in diff.items()})
+        return {
+            "updatedFormData": state["current"],
+            "version": state["version"],
+            "diff": diff,
+            "operations": operations,
+            "rebased": rebased,
+        }
+
+def _push_history(state: Dict[str, Any], form: Dict[str, Any],
+                  company_id: Optional[int] = None, manual_paths: Set[str] = frozenset()) -> None:
+    """
+    Pushes `form` onto the undo history together with the current manual edits
+    for `manual_paths` (the paths the new form sets by hand).
+    Caller holds FORM_STATES_LOCK.
+    """
+    state["history"].append(form)
+    manual_values = provenance_store.manual_edits(company_id, manual_paths) if manual_paths else {}
+    state["manual_history"].append((manual_paths, manual_values))
+
+def _record_change(state: Dict[str, Any], paths: Optional[Set[str]]) -> None:
+    """
+    Bumps the form version and remembers which paths changed (None = whole form).
+    Caller holds FORM_STATES_LOCK.
+    """
+    state["version"] += 1
+    state["changes"].append((state["version"], paths))
+    del state["changes"][:-MAX_TRACKED_CHANGES]
+
+def _paths_changed_since(state: Dict[str, Any], version: int) -> Optional[Set[str]]:
+    """
+    Returns the paths written after `version`, or None if unknown or the whole form
+    was replaced (generate/undo). Caller holds FORM_STATES_LOCK.
+    """
+    newer = [(v, paths) for v, paths in state["changes"] if v > version]
+    if len(newer) != state["version"] - version:
+        return None  # older than what we still track
+    changed: Set[str] = set()
+    for _, paths in newer:
+        if paths is None:
+            return None
+        changed |= paths
+    return changed
+
+def generate_form_dict(company_id: int, memory_data: Dict[str, Any],
+                       parsed_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Uses our form generation logic to extract and structure all fields from memory data.
+    Pass `parsed_data` to build the form from an extraction that was already done.
     """
-    from logic.form_generation import generate_form
     from services.parse_memory_service import parse_memory_data
     
-    # Parse all fields from memory data using Claude
-    parsed_data = parse_memory_data(memory_data)
+    if parsed_data is None:
+        # Parse all fields from memory data using Claude (None if nothing could be extracted)
+        parsed_data = parse_memory_data(memory_data, company_id=company_id) or {}
     
     # Convert to the format needed for our forms
     return {
@@ -235,14 +400,3 @@ def generate_pdf_and_save(company_id: int, form_fields: Dict[str, Any]) -> str:
     # Generate or fetch your PDF bytes here...
     # For the example, we skip actual PDF generation logic
     return f"/static/forms/form_{company_id}.pdf"
-
-def apply_command_logic(current_form: Dict[str, Any], command: str) -> Dict[str, Any]:
-    """
-    Uses Claude to intelligently interpret commands and update the form.
-    """
-    from logic.form_generation import update_form_logic
-    
-    # Use our intelligent form update logic
-    updated_form = update_form_logic(current_form, command)
-    
-    return updated_form
@@ -0,0 +1,13 @@
+# backend/routers/metrics.py
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from services.metrics_service import REGISTRY
+
+router = APIRouter()
+
+@router.get("", summary="Prometheus metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Returns stage latencies, LLM token counts and request metrics in Prometheus text format.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
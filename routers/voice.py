@@ -1,51 +1,135 @@
 # forms.py (or a new file, e.g. voice.py in the same directory)
 
-import openai
-from fastapi import APIRouter, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
-from config import OPENAI_API_KEY
+from typing import Optional
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query, Request
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from services.admission_service import DeadlineExceeded
+from services.audio_upload_service import audio_uploads, transcribe_upload, UploadStateError
 import os
-import tempfile
 
 router = APIRouter()
 
-openai.api_key = OPENAI_API_KEY
+# Request body bytes collected before each chunk-file write
+_WRITE_BUFFER_BYTES = 1024 * 1024
+
+class CreateUploadRequest(BaseModel):
+    filename: Optional[str] = None
+    total_chunks: Optional[int] = None
+
+class FinalizeUploadRequest(BaseModel):
+    total_chunks: Optional[int] = None
 
 @router.post("/transcribe")
-async def transcribe_voice(file: UploadFile = File(...)):
+def transcribe_voice(file: UploadFile = File(...)):
     """
     Receive an audio file, save it temporarily, and call OpenAI Whisper to transcribe.
     Returns { "transcript": "..." } on success.
+    Runs in the threadpool so the upload copy and Whisper call don't block the event loop;
+    long recordings are segmented and transcribed in parallel.
     """
     # Validate file type if needed
     # e.g. if file.content_type not in ["audio/wav", "audio/mpeg", "audio/webm"]: ...
     try:
-        # Save to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
-
-        # Use openai.Audio.transcribe
-        # If using 'whisper-1', you can do:
-        # transcript_data = openai.Audio.transcribe("whisper-1", open(tmp_path, "rb"))
-        # OR with the newer approach "openai.Audio.transcribe"
-        # For older openai libs, might be openai.Audio.create(...)
-        # We'll show the current approach:
-
-        transcript_data = openai.Audio.transcribe(
-            model="whisper-1",
-            file=open(tmp_path, "rb"),
-        )
-        # transcript_data is typically { "text": "... recognized text ..." }
-        recognized_text = transcript_data.get("text", "")
-
-        # Cleanup
-        os.remove(tmp_path)
-
-        return {"transcript": recognized_text}
-
+        suffix = os.path.splitext(file.filename or "")[1] or ".webm"
+        return {"transcript": transcribe_upload(file.file, suffix)}
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        # If something fails, remove the file
-        if 'tmp_path' in locals() and os.path.exists(tmp_path):
-            os.remove(tmp_path)
         raise HTTPException(status_code=500, detail=str(e))
+
+#
+# Resumable chunked uploads for long recordings:
+#   POST   /voice/uploads                          -> start, returns upload_id
+#   PUT    /voice/uploads/{id}/chunks/{index}      -> raw chunk bytes (re-send to retry)
+#   GET    /voice/uploads/{id}                     -> received/missing chunks, transcript when done
+#   POST   /voice/uploads/{id}/finalize            -> 202, assembles + transcribes in the background;
+#                                                     poll GET until state is "done" (or "error" is set)
+#   DELETE /voice/uploads/{id}                     -> abort
+#
+
+@router.post("/uploads")
+def create_upload(request: Optional[CreateUploadRequest] = None):
+    request = request or CreateUploadRequest()
+    try:
+        return audio_uploads.create(request.filename, request.total_chunks)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.put("/uploads/{upload_id}/chunks/{index}")
+async def upload_chunk(upload_id: str, index: int, request: Request,
+                       checksum: Optional[str] = Query(None, description="Optional sha256 hex digest of the chunk")):
+    """
+    Streams one chunk (raw request body) to disk, holding at most ~1 MB in memory;
+    the file writes run in the threadpool, off the event loop.
+    Chunks can arrive in any order; re-sending an index replaces it.
+    """
+    try:
+        writer = await run_in_threadpool(audio_uploads.begin_chunk, upload_id, index)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    try:
+        # Disk writes go through the threadpool, batched so small network reads
+        # don't each cost a thread hop
+        buffer = bytearray()
+        async for data in request.stream():
+            buffer += data
+            if len(buffer) >= _WRITE_BUFFER_BYTES:
+                await run_in_threadpool(writer.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(writer.write, bytes(buffer))
+        return await run_in_threadpool(writer.commit, checksum)
+    except KeyError:
+        writer.abort()
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except ValueError as e:
+        writer.abort()
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadStateError as e:
+        writer.abort()
+        raise HTTPException(status_code=409, detail=str(e))
+    except BaseException:
+        # Includes the client disconnecting mid-chunk; the chunk can simply be re-sent
+        writer.abort()
+        raise
+
+@router.get("/uploads/{upload_id}")
+def get_upload(upload_id: str):
+    try:
+        return audio_uploads.status(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+@router.post("/uploads/{upload_id}/finalize", status_code=202)
+def finalize_upload(upload_id: str, request: Optional[FinalizeUploadRequest] = None):
+    """
+    Starts assembling and transcribing the chunks in the background (long audio
+    in parallel segments) and returns the upload status; poll GET /uploads/{id}
+    for the transcript. Safe to call again: a finished upload returns its
+    transcript, a failed one keeps its chunks so finalize can be retried.
+    """
+    request = request or FinalizeUploadRequest()
+    try:
+        return audio_uploads.finalize(upload_id, request.total_chunks)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.delete("/uploads/{upload_id}")
+def delete_upload(upload_id: str):
+    try:
+        audio_uploads.delete(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"deleted": upload_id}
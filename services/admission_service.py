@@ -0,0 +1,275 @@
+"""Bulkheads, load shedding and per-request deadlines.
+
+Routes are split into groups (Claude-bound form routes, transcription, and
+everything else), each with its own concurrency limit and bounded wait queue,
+so slow LLM calls can't occupy every worker thread and stall cheap routes like
+/companies or /forms/undo. When a group's queue is full, or a request waits
+longer than BULKHEAD_QUEUE_TIMEOUT_SECONDS, it gets a fast 503 with a
+Retry-After estimate instead of piling up.
+
+Admitted requests get a deadline (per group). Upstream calls read it through
+`upstream_timeout` / `current_deadline`, so Claude, Whisper and Retool calls
+are cut off when the request runs over, and `DeadlineExceeded` becomes a 504.
+Sync routes can't be interrupted mid-call, so the deadline is enforced at the
+upstream calls rather than by cancelling the handler.
+"""
+
+import asyncio
+import contextvars
+import json
+import math
+import re
+import time
+from collections import deque
+from typing import Deque, Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from config import (
+    BULKHEAD_LLM_CONCURRENCY,
+    BULKHEAD_LLM_QUEUE,
+    BULKHEAD_LLM_DEADLINE_SECONDS,
+    BULKHEAD_TRANSCRIBE_CONCURRENCY,
+    BULKHEAD_TRANSCRIBE_QUEUE,
+    BULKHEAD_TRANSCRIBE_DEADLINE_SECONDS,
+    BULKHEAD_DEFAULT_CONCURRENCY,
+    BULKHEAD_DEFAULT_QUEUE,
+    BULKHEAD_DEFAULT_DEADLINE_SECONDS,
+    BULKHEAD_QUEUE_TIMEOUT_SECONDS,
+)
+from services.metrics_service import REGISTRY
+from services.tracing_service import log_error
+
+ADMISSIONS = REGISTRY.counter(
+    "harper_admissions_total",
+    "Requests by bulkhead outcome: admitted (no wait), queued (admitted after waiting), rejected (queue full), timeout (waited too long)",
+    ["group", "outcome"],
+)
+BULKHEAD_ACTIVE = REGISTRY.gauge(
+    "harper_bulkhead_active",
+    "Requests currently running in a bulkhead",
+    ["group"],
+)
+BULKHEAD_QUEUED = REGISTRY.gauge(
+    "harper_bulkhead_queued",
+    "Requests waiting for a bulkhead slot",
+    ["group"],
+)
+ADMISSION_WAIT = REGISTRY.histogram(
+    "harper_admission_wait_seconds",
+    "Time admitted requests waited for a bulkhead slot",
+    ["group"],
+)
+DEADLINES_EXCEEDED = REGISTRY.counter(
+    "harper_deadlines_exceeded_total",
+    "Requests that ran past their deadline and were answered with 504",
+    ["group"],
+)
+
+# Paths that are never queued or shed
+_EXEMPT_PREFIXES = ("/metrics", "/static", "/api/docs", "/api/redoc", "/api/openapi.json")
+
+# Bounds for the Retry-After estimate, in seconds
+_MIN_RETRY_AFTER = 1
+_MAX_RETRY_AFTER = 60
+# Weight of the latest request in the moving average of service times
+_DURATION_SMOOTHING = 0.2
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the current request's deadline has passed."""
+
+
+class BulkheadFull(Exception):
+    def __init__(self, group: str, retry_after: int):
+        super().__init__(f"Bulkhead {group} is full")
+        self.group = group
+        self.retry_after = retry_after
+
+
+def current_deadline() -> Optional[float]:
+    """time.monotonic() deadline of the current request, None outside a request."""
+    return _deadline.get()
+
+
+def upstream_timeout(default: float) -> float:
+    """
+    Timeout for an upstream call: `default`, shortened to what is left of the
+    request's deadline. Raises DeadlineExceeded if nothing is left.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline passed before the upstream call")
+    return min(default, remaining)
+
+
+def run_with_deadline(seconds: float, fn, *args, **kwargs):
+    """
+    Runs `fn` with its own deadline `seconds` from now, for background jobs
+    that outlive the request that started them.
+    """
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _deadline.reset(token)
+
+
+class Bulkhead:
+    """
+    Concurrency limit with a bounded FIFO wait queue. Used from the event loop
+    only, so the counters need no lock.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int,
+                 deadline_seconds: float, queue_timeout: float = BULKHEAD_QUEUE_TIMEOUT_SECONDS):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.deadline_seconds = deadline_seconds
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._avg_duration = 1.0
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free, from the recent average service time."""
+        estimate = self._avg_duration * (len(self._waiters) + 1) / max(1, self.max_concurrent)
+        return max(_MIN_RETRY_AFTER, min(_MAX_RETRY_AFTER, math.ceil(estimate)))
+
+    def _reject(self, outcome: str) -> BulkheadFull:
+        ADMISSIONS.inc(group=self.name, outcome=outcome)
+        return BulkheadFull(self.name, self.retry_after())
+
+    async def acquire(self) -> None:
+        """Takes a slot, waiting in the queue if needed; raises BulkheadFull to shed the request."""
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            BULKHEAD_ACTIVE.set(self.active, group=self.name)
+            ADMISSIONS.inc(group=self.name, outcome="admitted")
+            ADMISSION_WAIT.observe(0.0, group=self.name)
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("rejected")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        BULKHEAD_QUEUED.set(len(self._waiters), group=self.name)
+        started = time.monotonic()
+        try:
+            # release() hands the slot over by resolving the future (active already counted)
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise self._reject("timeout")
+        except asyncio.CancelledError:
+            # Client went away; give back a slot that was handed over in the meantime
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            BULKHEAD_QUEUED.set(len(self._waiters), group=self.name)
+        ADMISSIONS.inc(group=self.name, outcome="queued")
+        ADMISSION_WAIT.observe(time.monotonic() - started, group=self.name)
+
+    def release(self, duration: Optional[float] = None) -> None:
+        if duration is not None:
+            self._avg_duration += _DURATION_SMOOTHING * (duration - self._avg_duration)
+        self.active -= 1
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.active += 1
+                break
+        BULKHEAD_ACTIVE.set(self.active, group=self.name)
+        BULKHEAD_QUEUED.set(len(self._waiters), group=self.name)
+
+
+LLM_BULKHEAD = Bulkhead("llm", BULKHEAD_LLM_CONCURRENCY, BULKHEAD_LLM_QUEUE, BULKHEAD_LLM_DEADLINE_SECONDS)
+TRANSCRIBE_BULKHEAD = Bulkhead(
+    "transcribe", BULKHEAD_TRANSCRIBE_CONCURRENCY, BULKHEAD_TRANSCRIBE_QUEUE, BULKHEAD_TRANSCRIBE_DEADLINE_SECONDS
+)
+DEFAULT_BULKHEAD = Bulkhead(
+    "default", BULKHEAD_DEFAULT_CONCURRENCY, BULKHEAD_DEFAULT_QUEUE, BULKHEAD_DEFAULT_DEADLINE_SECONDS
+)
+
+# (path pattern matched at the start of the path, bulkhead); first match wins,
+# anything else (including audio chunk uploads and finalize, which only starts
+# a background job) uses DEFAULT_BULKHEAD
+ROUTE_GROUPS = (
+    (re.compile(r"/voice/transcribe|/forms/transcribe"), TRANSCRIBE_BULKHEAD),
+    (re.compile(r"/forms/(generate|update|refresh)"), LLM_BULKHEAD),
+)
+
+
+def bulkhead_for(path: str) -> Optional[Bulkhead]:
+    """Bulkhead for a request path, None for exempt paths."""
+    if path.startswith(_EXEMPT_PREFIXES):
+        return None
+    for pattern, bulkhead in ROUTE_GROUPS:
+        if pattern.match(path):
+            return bulkhead
+    return DEFAULT_BULKHEAD
+
+
+async def _send_unavailable(send, error: BulkheadFull) -> None:
+    body = json.dumps({"detail": "Server busy, retry later."}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"retry-after", str(error.retry_after).encode("latin-1")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits each request through its route group's bulkhead
+    (shedding with 503 + Retry-After when full) and sets the request deadline.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        bulkhead = bulkhead_for(scope.get("path", ""))
+        if bulkhead is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await bulkhead.acquire()
+        except BulkheadFull as e:
+            await _send_unavailable(send, e)
+            return
+
+        started = time.monotonic()
+        token = _deadline.set(started + bulkhead.deadline_seconds)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+            bulkhead.release(time.monotonic() - started)
+
+
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded) -> JSONResponse:
+    """Exception handler answering DeadlineExceeded with 504."""
+    bulkhead = bulkhead_for(request.url.path)
+    DEADLINES_EXCEEDED.inc(group=bulkhead.name if bulkhead else "exempt")
+    log_error("deadline", exc)
+    return JSONResponse(status_code=504, content={"detail": "Request deadline exceeded."})
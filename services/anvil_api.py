@@ -1,18 +1,20 @@
 """
 Service for interacting with Anvil's PDF filling API.
 """
-import os
-from python_anvil.api import Anvil
-from config import ANVIL_API_KEY
+from services.clients import get_anvil_client
+from services.tracing_service import trace_span
 
-def fill_pdf_with_anvil(data: dict) -> bytes:
+# ACORD 125 template, used when no template ID is given
+DEFAULT_TEMPLATE_ID = '7VCXZAolDIPToVLh3O3O'
+
+def fill_pdf_with_anvil(data: dict, template_id: str = DEFAULT_TEMPLATE_ID) -> bytes:
     """
     Sends JSON data to Anvil to fill a PDF or generate a form.
     Returns the PDF bytes that can be written to a file.
     """
-    template_id = '7VCXZAolDIPToVLh3O3O'  # Our template ID
-    anvil = Anvil(api_key=ANVIL_API_KEY)
+    anvil = get_anvil_client()
     
     # Fill the PDF with the provided data
-    pdf_bytes = anvil.fill_pdf(template_id, data)
+    with trace_span("anvil_fill"):
+        pdf_bytes = anvil.fill_pdf(template_id, data)
     return pdf_bytes
@@ -0,0 +1,462 @@
+"""Service for resumable chunked audio uploads and long-audio transcription.
+
+Long recordings are uploaded as numbered chunks, each streamed straight to
+disk and safe to re-send after a dropped connection. Finalizing an upload
+starts a background job (AUDIO_FINALIZE_MAX_JOBS at a time, each with its own
+AUDIO_FINALIZE_DEADLINE_SECONDS deadline) that clients poll for through the
+upload's status. The job:
+  1. concatenates the chunks on disk
+  2. sends audio up to AUDIO_DIRECT_TRANSCRIBE_MAX_BYTES to Whisper as is;
+     anything larger is transcoded by ffmpeg to 16 kHz mono MP3 and cut into
+     AUDIO_SEGMENT_SECONDS segments
+  3. transcribes the segments concurrently (TRANSCRIBE_MAX_WORKERS) and
+     stitches the transcripts back together in order
+
+Everything here blocks (disk, ffmpeg, Whisper), so async routes call it through
+run_in_threadpool. Upload state is a small JSON file next to the chunks, so an
+upload can be resumed after a restart.
+"""
+
+import contextvars
+import glob
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from config import (
+    AUDIO_UPLOAD_DIR,
+    AUDIO_CHUNK_MAX_BYTES,
+    AUDIO_UPLOAD_MAX_BYTES,
+    AUDIO_UPLOAD_MAX_CHUNKS,
+    AUDIO_UPLOAD_TTL_SECONDS,
+    AUDIO_DIRECT_TRANSCRIBE_MAX_BYTES,
+    AUDIO_SEGMENT_SECONDS,
+    TRANSCRIBE_MAX_WORKERS,
+    FFMPEG_BINARY,
+    AUDIO_FINALIZE_MAX_JOBS,
+    AUDIO_FINALIZE_DEADLINE_SECONDS,
+    LLM_TIMEOUT_SECONDS,
+)
+from services.admission_service import DeadlineExceeded, run_with_deadline, upstream_timeout
+from services.clients import get_openai_client
+from services.metrics_service import REGISTRY, BYTE_BUCKETS
+from services.tracing_service import trace_span, log_error
+
+UPLOADING = "uploading"
+FINALIZING = "finalizing"
+DONE = "done"
+
+AUDIO_UPLOAD_BYTES = REGISTRY.counter(
+    "harper_audio_upload_bytes_total",
+    "Audio bytes received through chunked uploads",
+)
+AUDIO_SIZE = REGISTRY.histogram(
+    "harper_audio_transcribed_bytes",
+    "Size of audio files sent for transcription",
+    ["mode"],
+    buckets=BYTE_BUCKETS,
+)
+TRANSCRIBE_SEGMENTS = REGISTRY.histogram(
+    "harper_transcribe_segments",
+    "Segments a long recording was split into",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+# Whisper rejects files above 25 MB
+_WHISPER_MAX_BYTES = 25 * 1024 * 1024
+_FFMPEG_TIMEOUT_SECONDS = 600.0
+_COPY_BUFFER_BYTES = 1024 * 1024
+# Missing chunk indexes listed in a status or error; the rest only counted
+_MISSING_REPORT_LIMIT = 100
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+_SUFFIX = re.compile(r"^\.[A-Za-z0-9]{1,8}$")
+_META_FILE = "upload.json"
+
+
+class UploadStateError(Exception):
+    """Raised for operations the upload's current state doesn't allow (e.g. a second finalize)."""
+
+
+def _chunk_name(index: int) -> str:
+    return f"chunk_{index:06d}"
+
+
+def _check_total_chunks(total_chunks: int) -> None:
+    if not 1 <= total_chunks <= AUDIO_UPLOAD_MAX_CHUNKS:
+        raise ValueError(f"total_chunks must be between 1 and {AUDIO_UPLOAD_MAX_CHUNKS}")
+
+
+def _missing(received: Dict[int, int], total: int) -> Tuple[List[int], int]:
+    """First missing chunk indexes (up to _MISSING_REPORT_LIMIT) and how many are missing."""
+    first = list(itertools.islice((i for i in range(total) if i not in received), _MISSING_REPORT_LIMIT))
+    return first, total - sum(1 for i in received if i < total)
+
+
+class ChunkWriter:
+    """
+    Streams one chunk to a temporary file; `commit` moves it into place, so a
+    chunk that was cut off never counts as received.
+    """
+
+    def __init__(self, store: "AudioUploadStore", upload_id: str, index: int):
+        self.store = store
+        self.upload_id = upload_id
+        self.index = index
+        self.size = 0
+        self._hash = hashlib.sha256()
+        upload_dir = store.upload_dir(upload_id)
+        fd, self._tmp_path = tempfile.mkstemp(prefix=f".{_chunk_name(index)}.", dir=upload_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > AUDIO_CHUNK_MAX_BYTES:
+            raise ValueError(f"Chunk exceeds {AUDIO_CHUNK_MAX_BYTES} bytes")
+        self._hash.update(data)
+        self._file.write(data)
+
+    def commit(self, checksum: Optional[str] = None) -> Dict[str, Any]:
+        """Stores the chunk; `checksum` is an optional sha256 hex digest to verify against."""
+        self._file.close()
+        if checksum and checksum.lower() != self._hash.hexdigest():
+            self.abort()
+            raise ValueError("Chunk checksum mismatch")
+        if self.size == 0:
+            self.abort()
+            raise ValueError("Empty chunk")
+        return self.store._commit_chunk(self.upload_id, self.index, self._tmp_path, self.size)
+
+    def abort(self) -> None:
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class AudioUploadStore:
+    def __init__(self, root: str):
+        self.root = root
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        # Uploads this process is finalizing; a persisted "finalizing" state without
+        # an entry here was interrupted by a restart and counts as uploading again
+        self._finalizing = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_guard = threading.Lock()
+
+    # Paths and state
+
+    def upload_dir(self, upload_id: str) -> str:
+        if not _UPLOAD_ID.match(upload_id or ""):
+            raise KeyError(upload_id)
+        path = os.path.join(self.root, upload_id)
+        if not os.path.isdir(path):
+            raise KeyError(upload_id)
+        return path
+
+    def _lock(self, upload_id: str) -> threading.Lock:
+        self.upload_dir(upload_id)  # KeyError for unknown uploads
+        with self._locks_guard:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _read_meta(self, upload_id: str) -> Dict[str, Any]:
+        with open(os.path.join(self.upload_dir(upload_id), _META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["state"] == FINALIZING and upload_id not in self._finalizing:
+            meta["state"] = UPLOADING
+        return meta
+
+    def _write_meta(self, upload_id: str, meta: Dict[str, Any]) -> None:
+        meta["updated"] = time.time()
+        path = os.path.join(self.upload_dir(upload_id), _META_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    def _received(self, upload_id: str) -> Dict[int, int]:
+        """Received chunk sizes by index."""
+        upload_dir = self.upload_dir(upload_id)
+        received = {}
+        for name in os.listdir(upload_dir):
+            if name.startswith("chunk_"):
+                received[int(name[len("chunk_"):])] = os.path.getsize(os.path.join(upload_dir, name))
+        return received
+
+    def _status(self, upload_id: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+        received = self._received(upload_id)
+        status = {
+            "upload_id": upload_id,
+            "state": meta["state"],
+            "total_chunks": meta.get("total_chunks"),
+            "received": sorted(received),
+            "received_bytes": sum(received.values()),
+            "chunk_max_bytes": AUDIO_CHUNK_MAX_BYTES,
+        }
+        if meta["state"] == UPLOADING and meta.get("total_chunks") is not None:
+            status["missing"], status["missing_count"] = _missing(received, meta["total_chunks"])
+        for key in ("transcript", "segments", "error"):
+            if meta.get(key) is not None:
+                status[key] = meta[key]
+        return status
+
+    # Upload lifecycle
+
+    def create(self, filename: Optional[str] = None, total_chunks: Optional[int] = None) -> Dict[str, Any]:
+        """Starts an upload; `total_chunks` may be left out and given at finalize instead."""
+        if total_chunks is not None:
+            _check_total_chunks(total_chunks)
+        self.sweep_expired()
+        suffix = os.path.splitext(filename or "")[1].lower()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.root, upload_id))
+        meta = {
+            "state": UPLOADING,
+            "suffix": suffix if _SUFFIX.match(suffix) else ".webm",
+            "total_chunks": total_chunks,
+            "created": time.time(),
+        }
+        self._write_meta(upload_id, meta)
+        return self._status(upload_id, meta)
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        with self._lock(upload_id):
+            return self._status(upload_id, self._read_meta(upload_id))
+
+    def begin_chunk(self, upload_id: str, index: int) -> ChunkWriter:
+        """Opens a writer for chunk `index`; re-sending a chunk replaces it."""
+        if not 0 <= index < AUDIO_UPLOAD_MAX_CHUNKS:
+            raise ValueError(f"Chunk index must be between 0 and {AUDIO_UPLOAD_MAX_CHUNKS - 1}")
+        meta = self._read_meta(upload_id)
+        if meta["state"] != UPLOADING:
+            raise UploadStateError(f"Upload is {meta['state']}")
+        if meta.get("total_chunks") is not None and index >= meta["total_chunks"]:
+            raise ValueError(f"Chunk index must be below {meta['total_chunks']}")
+        return ChunkWriter(self, upload_id, index)
+
+    def _commit_chunk(self, upload_id: str, index: int, tmp_path: str, size: int) -> Dict[str, Any]:
+        with self._lock(upload_id):
+            meta = self._read_meta(upload_id)
+            received = self._received(upload_id)
+            if meta["state"] != UPLOADING:
+                os.remove(tmp_path)
+                raise UploadStateError(f"Upload is {meta['state']}")
+            received[index] = size
+            if sum(received.values()) > AUDIO_UPLOAD_MAX_BYTES:
+                os.remove(tmp_path)
+                raise ValueError(f"Upload exceeds {AUDIO_UPLOAD_MAX_BYTES} bytes")
+            os.replace(tmp_path, os.path.join(self.upload_dir(upload_id), _chunk_name(index)))
+            # Keeps an upload that is still receiving chunks from being swept
+            self._write_meta(upload_id, meta)
+        AUDIO_UPLOAD_BYTES.inc(size)
+        return {"index": index, "bytes": size, "received_bytes": sum(received.values())}
+
+    def finalize(self, upload_id: str, total_chunks: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Checks the upload is complete and starts assembling and transcribing it
+        in the background; returns the "finalizing" status to poll. Finalizing a
+        finished upload returns its transcript again; if transcription fails the
+        chunks are kept and the error shows in the status, so finalize can be retried.
+        """
+        with self._lock(upload_id):
+            meta = self._read_meta(upload_id)
+            if meta["state"] == DONE:
+                return self._status(upload_id, meta)
+            if meta["state"] == FINALIZING:
+                raise UploadStateError("Upload is already being finalized")
+            received = self._received(upload_id)
+            if total_chunks is not None:
+                _check_total_chunks(total_chunks)
+            total = total_chunks if total_chunks is not None else meta.get("total_chunks")
+            if total is None:
+                total = max(received) + 1 if received else 0
+            missing, missing_count = _missing(received, total)
+            if not received:
+                raise ValueError("Upload incomplete, no chunks received")
+            if missing_count:
+                raise ValueError(f"Upload incomplete, {missing_count} missing chunks, first: {missing}")
+            extra = [i for i in received if i >= total]
+            if extra:
+                raise ValueError(f"Chunks beyond total_chunks received: {sorted(extra)}")
+            meta.update(state=FINALIZING, total_chunks=total, error=None)
+            self._finalizing.add(upload_id)
+            self._write_meta(upload_id, meta)
+            try:
+                # Not copy_context: the job gets its own deadline, not the request's
+                self._executor_for_jobs().submit(
+                    run_with_deadline, AUDIO_FINALIZE_DEADLINE_SECONDS, self._run_finalize, upload_id, meta
+                )
+            except RuntimeError:
+                # Executor shut down
+                self._finalizing.discard(upload_id)
+                meta["state"] = UPLOADING
+                self._write_meta(upload_id, meta)
+                raise UploadStateError("Server is shutting down, retry finalize later")
+            return self._status(upload_id, meta)
+
+    def _executor_for_jobs(self) -> ThreadPoolExecutor:
+        with self._executor_guard:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=AUDIO_FINALIZE_MAX_JOBS, thread_name_prefix="audio-finalize")
+            return self._executor
+
+    def _run_finalize(self, upload_id: str, meta: Dict[str, Any]) -> None:
+        total = meta["total_chunks"]
+        try:
+            upload_dir = self.upload_dir(upload_id)
+            audio_path = os.path.join(upload_dir, f"audio{meta['suffix']}")
+            try:
+                with trace_span("audio_assemble"), open(audio_path, "wb") as out:
+                    for index in range(total):
+                        with open(os.path.join(upload_dir, _chunk_name(index)), "rb") as chunk:
+                            shutil.copyfileobj(chunk, out, _COPY_BUFFER_BYTES)
+                transcript, segments = transcribe_audio_file(audio_path)
+            finally:
+                if os.path.exists(audio_path):
+                    os.remove(audio_path)
+        except Exception as e:
+            log_error("audio_upload_finalize", e)
+            with self._lock(upload_id):
+                meta.update(state=UPLOADING, error=str(e))
+                self._write_meta(upload_id, meta)
+                self._finalizing.discard(upload_id)
+            return
+
+        with self._lock(upload_id):
+            for index in range(total):
+                os.remove(os.path.join(upload_dir, _chunk_name(index)))
+            meta.update(state=DONE, transcript=transcript, segments=segments)
+            self._write_meta(upload_id, meta)
+            self._finalizing.discard(upload_id)
+
+    def shutdown(self) -> None:
+        """Stops finalize jobs that haven't started; their uploads can be finalized again."""
+        with self._executor_guard:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def delete(self, upload_id: str) -> None:
+        with self._lock(upload_id):
+            meta = self._read_meta(upload_id)
+            if meta["state"] == FINALIZING:
+                raise UploadStateError("Upload is being finalized")
+            shutil.rmtree(self.upload_dir(upload_id), ignore_errors=True)
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+
+    def sweep_expired(self) -> None:
+        """Deletes uploads with no activity for AUDIO_UPLOAD_TTL_SECONDS."""
+        os.makedirs(self.root, exist_ok=True)
+        cutoff = time.time() - AUDIO_UPLOAD_TTL_SECONDS
+        for upload_id in os.listdir(self.root):
+            if not _UPLOAD_ID.match(upload_id):
+                continue
+            try:
+                meta = self._read_meta(upload_id)
+                if meta.get("updated", meta["created"]) < cutoff and meta["state"] != FINALIZING:
+                    self.delete(upload_id)
+            except (KeyError, OSError, ValueError) as e:
+                log_error("audio_upload_sweep", e)
+
+
+audio_uploads = AudioUploadStore(AUDIO_UPLOAD_DIR)
+
+
+def _transcribe_file(path: str) -> str:
+    # Shared OpenAI client; the timeout is shortened to the request's remaining deadline
+    with trace_span("whisper_transcribe"), open(path, "rb") as audio_file:
+        transcript_data = get_openai_client().audio.transcriptions.create(
+            model="whisper-1",
+            file=audio_file,
+            timeout=upstream_timeout(LLM_TIMEOUT_SECONDS),
+        )
+    return transcript_data.text or ""
+
+
+def _segment_audio(path: str, out_dir: str) -> List[str]:
+    """
+    Transcodes `path` to 16 kHz mono MP3 segments of AUDIO_SEGMENT_SECONDS with
+    ffmpeg and returns their paths in order.
+    """
+    command = [
+        FFMPEG_BINARY, "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", path,
+        "-vn", "-ac", "1", "-ar", "16000", "-c:a", "libmp3lame", "-b:a", "64k",
+        "-f", "segment", "-segment_time", str(AUDIO_SEGMENT_SECONDS), "-reset_timestamps", "1",
+        os.path.join(out_dir, "segment_%04d.mp3"),
+    ]
+    with trace_span("audio_segment"):
+        try:
+            completed = subprocess.run(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                timeout=upstream_timeout(_FFMPEG_TIMEOUT_SECONDS),
+            )
+        except subprocess.TimeoutExpired as e:
+            # subprocess.run has already killed ffmpeg
+            raise DeadlineExceeded(f"ffmpeg ran longer than {e.timeout:.0f}s") from e
+    if completed.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {completed.stderr.decode('utf-8', 'replace')[-500:]}")
+    segments = sorted(glob.glob(os.path.join(out_dir, "segment_*.mp3")))
+    if not segments:
+        raise ValueError("No audio found in the upload")
+    return segments
+
+
+def transcribe_audio_file(path: str) -> Tuple[str, int]:
+    """
+    Transcribes an audio file of any length. Returns the transcript and the
+    number of segments it was split into.
+    """
+    size = os.path.getsize(path)
+    if size <= AUDIO_DIRECT_TRANSCRIBE_MAX_BYTES:
+        AUDIO_SIZE.observe(size, mode="direct")
+        return _transcribe_file(path), 1
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(path)) as segment_dir:
+        try:
+            segments = _segment_audio(path, segment_dir)
+        except FileNotFoundError as e:
+            # No ffmpeg on this host: still fine for anything Whisper accepts in one piece
+            if size > _WHISPER_MAX_BYTES:
+                raise RuntimeError("ffmpeg is required to transcribe audio larger than 25 MB") from e
+            log_error("audio_segment", e)
+            AUDIO_SIZE.observe(size, mode="direct")
+            return _transcribe_file(path), 1
+        AUDIO_SIZE.observe(size, mode="segmented")
+        TRANSCRIBE_SEGMENTS.observe(len(segments))
+
+        with ThreadPoolExecutor(max_workers=max(1, min(len(segments), TRANSCRIBE_MAX_WORKERS))) as pool:
+            # copy_context keeps the caller's trace and deadline in the worker threads
+            futures = [pool.submit(contextvars.copy_context().run, _transcribe_file, segment) for segment in segments]
+            texts = [future.result() for future in futures]
+    return " ".join(text.strip() for text in texts if text.strip()), len(segments)
+
+
+def transcribe_upload(file: BinaryIO, suffix: str = ".webm") -> str:
+    """
+    Spools an uploaded file to disk in blocks (never fully in memory) and
+    transcribes it; used by the single-request /transcribe endpoints.
+    """
+    os.makedirs(AUDIO_UPLOAD_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=AUDIO_UPLOAD_DIR) as tmp:
+        shutil.copyfileobj(file, tmp, _COPY_BUFFER_BYTES)
+        tmp_path = tmp.name
+    try:
+        transcript, _ = transcribe_audio_file(tmp_path)
+        return transcript
+    finally:
+        os.remove(tmp_path)
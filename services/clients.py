@@ -0,0 +1,132 @@
+"""Shared API clients for the whole application.
+
+Clients are created once and reused by every request so connection pools
+(TLS sessions, keep-alive connections) are shared instead of rebuilt per call.
+Heavy SDKs (anthropic, openai, python_anvil) are imported on first use only,
+which keeps them out of the import path at startup. httpx is imported normally:
+the HTTP pool is opened at startup and memory_service catches its errors.
+
+`init_clients` / `close_clients` are driven by the application lifespan in
+`app.create_app`.
+"""
+
+import threading
+from typing import Any, Callable, Dict
+
+import httpx
+
+from config import (
+    ANTHROPIC_API_KEY,
+    OPENAI_API_KEY,
+    ANVIL_API_KEY,
+    HTTP_TIMEOUT_SECONDS,
+    HTTP_MAX_CONNECTIONS,
+    PREWARM_CLIENTS,
+)
+from services.tracing_service import trace_span, log_error
+
+_clients: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(name: str, factory: Callable[[], Any]) -> Any:
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            with trace_span(f"client_init_{name}"):
+                client = factory()
+            _clients[name] = client
+        return client
+
+
+def _create_anthropic():
+    from anthropic import Anthropic
+
+    if not ANTHROPIC_API_KEY:
+        raise ValueError("ANTHROPIC_API_KEY environment variable not set")
+    # Retries are handled by services.llm_scheduler so 429s feed its adaptive backoff
+    return Anthropic(api_key=ANTHROPIC_API_KEY, max_retries=0)
+
+
+def _create_openai():
+    from openai import OpenAI
+
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY environment variable not set")
+    return OpenAI(api_key=OPENAI_API_KEY)
+
+
+def _create_anvil():
+    from python_anvil.api import Anvil
+
+    return Anvil(api_key=ANVIL_API_KEY)
+
+
+def _create_http():
+    return httpx.Client(
+        timeout=HTTP_TIMEOUT_SECONDS,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+        ),
+    )
+
+
+def get_anthropic_client():
+    """Returns the shared Anthropic client, creating it on first use."""
+    return _get_or_create("anthropic", _create_anthropic)
+
+
+def get_openai_client():
+    """Returns the shared OpenAI client, creating it on first use."""
+    return _get_or_create("openai", _create_openai)
+
+
+def get_anvil_client():
+    """Returns the shared Anvil client, creating it on first use."""
+    return _get_or_create("anvil", _create_anvil)
+
+
+def get_http_client():
+    """Returns the shared pooled httpx client used for Retool calls."""
+    return _get_or_create("http", _create_http)
+
+
+def _prewarm() -> None:
+    for getter in (get_anthropic_client, get_openai_client, get_anvil_client):
+        try:
+            getter()
+        except Exception as e:
+            log_error("client_prewarm", e)
+
+
+def init_clients() -> None:
+    """
+    Called on application startup. Opens the HTTP pool and, when PREWARM_CLIENTS
+    is set, builds the SDK clients in a background thread so the first request
+    doesn't pay for the imports while startup itself stays fast.
+    """
+    get_http_client()
+    if PREWARM_CLIENTS:
+        threading.Thread(target=_prewarm, name="client-prewarm", daemon=True).start()
+
+
+def close_clients() -> None:
+    """
+    Called on application shutdown. Closes every client that was created.
+    """
+    with _lock:
+        clients = list(_clients.items())
+        _clients.clear()
+    for name, client in clients:
+        close = getattr(client, "close", None)
+        if close is None:
+            continue
+        try:
+            close()
+        except Exception as e:
+            log_error(f"client_close_{name}", e)
@@ -0,0 +1,201 @@
+"""Service for the cached, searchable company list.
+
+The Retool company list is fetched at most once per COMPANY_LIST_TTL_SECONDS
+(concurrent refreshes are coalesced) and kept in memory together with a small
+search index:
+  - name prefixes (whole name and each word) and ID prefixes via sorted lists + bisect
+  - substring and fuzzy (difflib) matching on names as a fallback
+If a refresh fails, the previous copy keeps being served and the next attempt
+waits COMPANY_LIST_RETRY_SECONDS.
+"""
+
+import base64
+import bisect
+import binascii
+import difflib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import COMPANY_LIST_TTL_SECONDS, COMPANY_LIST_RETRY_SECONDS
+from services.memory_service import fetch_companies
+from services.singleflight import SingleFlight, content_hash
+from services.tracing_service import trace_span, log_error
+
+SORT_OPTIONS = ("relevance", "name", "-name", "id", "-id")
+
+# Minimum difflib similarity for a fuzzy name match
+_FUZZY_CUTOFF = 0.6
+_SEARCH_CACHE_SIZE = 128
+
+
+def _company_id(company: Any) -> str:
+    if isinstance(company, dict):
+        for key in ("id", "company_id", "companyId"):
+            if company.get(key) is not None:
+                return str(company[key])
+    return ""
+
+
+def _company_name(company: Any) -> str:
+    if isinstance(company, dict):
+        for key in ("name", "company_name", "companyName"):
+            if company.get(key):
+                return str(company[key])
+    return ""
+
+
+class CompanyIndex:
+    """Immutable search index over one snapshot of the company list."""
+
+    def __init__(self, companies: List[Any]):
+        self.companies = companies
+        self.version = content_hash(companies)[:16]
+        self._ids = [_company_id(c) for c in companies]
+        self._names = [_company_name(c) for c in companies]
+        self._lower_names = [name.lower() for name in self._names]
+        self._positions_by_name: Dict[str, List[int]] = {}
+        for pos, lower in enumerate(self._lower_names):
+            self._positions_by_name.setdefault(lower, []).append(pos)
+
+        # (prefix key, position) pairs, sorted for bisect
+        name_keys: List[Tuple[str, int]] = []
+        for pos, lower in enumerate(self._lower_names):
+            name_keys.append((lower, pos))
+            for word in lower.split()[1:]:
+                name_keys.append((word, pos))
+        self._name_keys = sorted(name_keys)
+        self._id_keys = sorted((company_id.lower(), pos) for pos, company_id in enumerate(self._ids))
+        self._search_cache: "OrderedDict[Tuple[str, bool], List[int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _prefix_positions(keys: List[Tuple[str, int]], prefix: str) -> List[int]:
+        start = bisect.bisect_left(keys, (prefix,))
+        positions = []
+        for key, pos in keys[start:]:
+            if not key.startswith(prefix):
+                break
+            positions.append(pos)
+        return positions
+
+    def search(self, q: str, fuzzy: bool = True) -> List[int]:
+        """
+        Returns positions of matching companies, best matches first:
+        exact ID, name/word/ID prefix, name substring, then fuzzy name matches.
+        """
+        q = q.strip().lower()
+        cache_key = (q, fuzzy)
+        with self._lock:
+            cached = self._search_cache.get(cache_key)
+            if cached is not None:
+                self._search_cache.move_to_end(cache_key)
+                return cached
+
+        ranked: List[int] = []
+        seen = set()
+
+        def add(positions):
+            for pos in positions:
+                if pos not in seen:
+                    seen.add(pos)
+                    ranked.append(pos)
+
+        add(pos for pos, company_id in enumerate(self._ids) if company_id.lower() == q)
+        # Prefix hits ordered by name so "acme" lists "Acme Co" before "Acme Roofing"
+        prefix_hits = set(self._prefix_positions(self._name_keys, q)) | set(self._prefix_positions(self._id_keys, q))
+        add(sorted(prefix_hits, key=lambda pos: self._lower_names[pos]))
+        add(pos for pos, lower in enumerate(self._lower_names) if q in lower)
+        if fuzzy and q:
+            close = difflib.get_close_matches(q, list(self._positions_by_name), n=50, cutoff=_FUZZY_CUTOFF)
+            add(pos for name in close for pos in self._positions_by_name[name])
+
+        with self._lock:
+            self._search_cache[cache_key] = ranked
+            while len(self._search_cache) > _SEARCH_CACHE_SIZE:
+                self._search_cache.popitem(last=False)
+        return ranked
+
+    def query(self, q: Optional[str], sort: str, fuzzy: bool = True) -> List[Any]:
+        """
+        Returns the companies matching `q` (all if empty) in `sort` order.
+        "relevance" keeps search ranking, or the Retool order when there is no query.
+        """
+        positions = self.search(q, fuzzy) if q and q.strip() else list(range(len(self.companies)))
+        if sort in ("name", "-name"):
+            positions = sorted(positions, key=lambda pos: self._lower_names[pos], reverse=sort == "-name")
+        elif sort in ("id", "-id"):
+            def id_key(pos):
+                company_id = self._ids[pos]
+                # Numeric IDs sort numerically, anything else after them as text
+                return (0, int(company_id), "") if company_id.isdigit() else (1, 0, company_id)
+            positions = sorted(positions, key=id_key, reverse=sort == "-id")
+        return [self.companies[pos] for pos in positions]
+
+
+def encode_cursor(offset: int) -> str:
+    """Opaque pagination cursor for the item at `offset`."""
+    return base64.urlsafe_b64encode(json.dumps({"o": offset}).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Offset encoded by `encode_cursor`; raises ValueError for anything else."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))["o"]
+    except (binascii.Error, ValueError, KeyError, TypeError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError("Invalid cursor")
+    return offset
+
+
+def list_etag(index: CompanyIndex, *params: Any) -> str:
+    """Weak ETag for one view (query, sort, page) of one list snapshot."""
+    return f'W/"{index.version}-{content_hash(list(params))[:16]}"'
+
+
+class CompanyDirectory:
+    """
+    Holds the current CompanyIndex and refreshes it from Retool when stale.
+    After a failed refresh the stale copy is served for `retry_seconds` before
+    the next attempt, so an outage doesn't turn every request into a Retool call.
+    """
+
+    def __init__(self, ttl_seconds: float, retry_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self._index: Optional[CompanyIndex] = None
+        self._fetched_at = 0.0
+        self._failed_at: Optional[float] = None
+        self._flight = SingleFlight("company_list", copy_result=False)
+
+    def _refresh(self) -> CompanyIndex:
+        try:
+            companies = fetch_companies()
+        except Exception as e:
+            log_error("company_list_refresh", e)
+            self._failed_at = time.monotonic()
+            # Keep serving the last good copy; with none, answer empty without caching it
+            return self._index if self._index is not None else CompanyIndex([])
+        with trace_span("company_index_build"):
+            index = CompanyIndex(companies if isinstance(companies, list) else [])
+        self._index = index
+        self._fetched_at = time.monotonic()
+        self._failed_at = None
+        return index
+
+    def get_index(self, refresh: bool = False) -> CompanyIndex:
+        index = self._index
+        now = time.monotonic()
+        if index is not None and not refresh and now - self._fetched_at < self.ttl_seconds:
+            return index
+        # Backing off after a failure, even for explicit refreshes
+        if self._failed_at is not None and now - self._failed_at < self.retry_seconds:
+            return index if index is not None else CompanyIndex([])
+        return self._flight.do("refresh", self._refresh)
+
+
+company_directory = CompanyDirectory(COMPANY_LIST_TTL_SECONDS, COMPANY_LIST_RETRY_SECONDS)
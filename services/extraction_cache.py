@@ -0,0 +1,124 @@
+"""In-memory cache of Claude extraction results.
+
+Keyed by company ID plus a content hash of the cleaned memory and requested
+fields (see `parse_memory_service.extraction_key`), so a result is only reused
+for exactly the same input. Entries expire after EXTRACTION_CACHE_TTL_SECONDS
+and the least recently used entries are evicted beyond
+EXTRACTION_CACHE_MAX_ENTRIES.
+
+Entries produced by a speculative prefetch are tracked separately so we can
+measure the prefetch hit rate and the tokens spent on prefetches nobody used.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from config import EXTRACTION_CACHE_TTL_SECONDS, EXTRACTION_CACHE_MAX_ENTRIES
+from services.metrics_service import REGISTRY
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "harper_extraction_cache_lookups_total",
+    "Extraction cache lookups by result",
+    ["result"],
+)
+PREFETCH_HITS = REGISTRY.counter(
+    "harper_prefetch_hits_total",
+    "Extractions served from a result produced by a speculative prefetch",
+)
+PREFETCH_WASTED_TOKENS = REGISTRY.counter(
+    "harper_prefetch_wasted_tokens_total",
+    "Tokens spent on prefetched extractions that expired or were evicted without being used",
+)
+
+
+class _Entry:
+    __slots__ = ("result", "tokens", "origin", "used", "expires")
+
+    def __init__(self, result: Dict[str, Any], tokens: int, origin: str, expires: float):
+        self.result = result
+        self.tokens = tokens
+        self.origin = origin
+        self.used = False
+        self.expires = expires
+
+
+class ExtractionCache:
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _drop(self, key: str) -> None:
+        # Caller holds the lock
+        entry = self._entries.pop(key)
+        if entry.origin == "prefetch" and not entry.used:
+            PREFETCH_WASTED_TOKENS.inc(entry.tokens)
+
+    def _expire(self, now: float) -> None:
+        # Caller holds the lock
+        for key in [k for k, e in self._entries.items() if e.expires <= now]:
+            self._drop(key)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns a copy of the cached result for `key`, or None.
+        Does not count as a use of a prefetched entry; see `mark_used`.
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is None:
+                CACHE_LOOKUPS.inc(result="miss")
+                return None
+            self._entries.move_to_end(key)
+            CACHE_LOOKUPS.inc(result="hit")
+            return copy.deepcopy(entry.result)
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.expires > time.monotonic()
+
+    def put(self, key: str, result: Dict[str, Any], tokens: int, origin: str) -> None:
+        """
+        Stores `result` for `key`. `origin` is "prefetch" for speculative runs,
+        anything else for results computed for a waiting request.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _Entry(
+                copy.deepcopy(result), tokens, origin, time.monotonic() + self.ttl_seconds
+            )
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def mark_used(self, key: str) -> None:
+        """
+        Records that a request consumed the result for `key`; the first use of a
+        prefetched entry counts as a prefetch hit.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not entry.used:
+                entry.used = True
+                if entry.origin == "prefetch":
+                    PREFETCH_HITS.inc()
+
+    def record_wasted(self, tokens: int) -> None:
+        """
+        Records tokens spent on a prefetch that produced no usable result.
+        """
+        PREFETCH_WASTED_TOKENS.inc(tokens)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_TTL_SECONDS, EXTRACTION_CACHE_MAX_ENTRIES)
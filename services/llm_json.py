@@ -0,0 +1,199 @@
+"""Helpers for getting JSON out of LLM responses.
+
+Claude usually answers with a single JSON object, but not always cleanly:
+the object may be wrapped in ``` fences, followed by an explanation, contain
+trailing commas, or be cut off when the response hits max_tokens. These
+helpers recover as much of the object as possible instead of failing outright.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+_PRIMITIVE_END = set(",}] \t\r\n")
+
+
+def _strip_fences(text: str) -> str:
+    if "```" not in text:
+        return text
+    after = text.split("```", 1)[1]
+    # Drop the language tag line (```json)
+    first_newline = after.find("\n")
+    if first_newline != -1 and after[:first_newline].strip().isalpha():
+        after = after[first_newline + 1:]
+    # A truncated response may be missing the closing fence
+    return after.split("```", 1)[0]
+
+
+def _strip_trailing_commas(text: str) -> str:
+    """Drops commas directly before a closing } or ], leaving string contents alone."""
+    out: List[str] = []
+    i = 0
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch == '"':
+            j = i + 1
+            while j < n and text[j] != '"':
+                j += 2 if text[j] == "\\" else 1
+            out.append(text[i:j + 1])
+            i = j + 1
+            continue
+        if ch == ",":
+            j = i + 1
+            while j < n and text[j] in " \t\r\n":
+                j += 1
+            if j < n and text[j] in "}]":
+                i += 1
+                continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def _close_truncated(text: str) -> Optional[str]:
+    """
+    Cuts `text` (starting at "{") after the last complete value and closes any
+    open arrays/objects. Returns None if no complete value was found.
+    """
+    # Each stack entry is [bracket, state]; objects go key -> colon -> value -> comma
+    stack: List[List[str]] = []
+    safe_end = None
+    safe_closers = ""
+    i = 0
+    n = len(text)
+
+    def value_done(end: int) -> None:
+        nonlocal safe_end, safe_closers
+        if stack:
+            stack[-1][1] = "comma"
+        safe_end = end
+        safe_closers = "".join("}" if b == "{" else "]" for b, _ in reversed(stack))
+
+    while i < n:
+        ch = text[i]
+        if ch in " \t\r\n":
+            i += 1
+            continue
+        state = stack[-1][1] if stack else "value"
+        if ch in "{[":
+            stack.append([ch, "key" if ch == "{" else "value"])
+            i += 1
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            i += 1
+            value_done(i)
+            if not stack:
+                break
+        elif ch == '"':
+            j = i + 1
+            while j < n and text[j] != '"':
+                j += 2 if text[j] == "\\" else 1
+            if j >= n:
+                break  # unterminated string
+            i = j + 1
+            if state == "key":
+                stack[-1][1] = "colon"
+            else:
+                value_done(i)
+        elif ch == ":":
+            if stack:
+                stack[-1][1] = "value"
+            i += 1
+        elif ch == ",":
+            if stack:
+                stack[-1][1] = "key" if stack[-1][0] == "{" else "value"
+            i += 1
+        else:
+            j = i
+            while j < n and text[j] not in _PRIMITIVE_END:
+                j += 1
+            if j >= n:
+                break  # number/literal may be cut short
+            i = j
+            value_done(i)
+
+    if safe_end is None:
+        return None
+    return text[:safe_end] + safe_closers
+
+
+def extract_json(text: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Extracts the first JSON object from an LLM response.
+    Handles ``` fences, text before/after the object, trailing commas and
+    truncated output (keeping every complete key/value). Returns None if no
+    object could be recovered.
+    """
+    if not text:
+        return None
+    body = _strip_fences(text)
+    start = body.find("{")
+    if start == -1:
+        return None
+    body = body[start:]
+
+    decoder = json.JSONDecoder()
+    candidates = [body, _strip_trailing_commas(body)]
+    for candidate in candidates:
+        try:
+            result, _ = decoder.raw_decode(candidate)
+            if isinstance(result, dict):
+                return result
+        except json.JSONDecodeError:
+            pass
+
+    for candidate in candidates:
+        closed = _close_truncated(candidate)
+        if closed is None:
+            continue
+        try:
+            result = json.loads(_strip_trailing_commas(closed))
+            if isinstance(result, dict):
+                return result
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+_LEAF_TYPES = (str, int, float, bool, type(None))
+
+
+def validate_fields(result: Optional[Dict[str, Any]], field_mapping: Dict[str, str]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Checks `result` against the dotted keys of `field_mapping` ("parent.child"
+    means result["parent"]["child"]). Returns the valid values by dotted key and
+    the dotted keys that are missing or not a scalar/null.
+    """
+    valid: Dict[str, Any] = {}
+    invalid: List[str] = []
+    result = result if isinstance(result, dict) else {}
+    for key in field_mapping:
+        container: Any = result
+        found = True
+        for part in key.split("."):
+            if not isinstance(container, dict) or part not in container:
+                found = False
+                break
+            container = container[part]
+        if found and isinstance(container, _LEAF_TYPES):
+            valid[key] = container
+        else:
+            invalid.append(key)
+    return valid, invalid
+
+
+def nest_fields(values: Dict[str, Any], field_mapping: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Builds the nested result for `field_mapping` from dotted-key values.
+    Fields without a value are set to None, so nested parents are always dicts.
+    """
+    nested: Dict[str, Any] = {}
+    for key in field_mapping:
+        parts = key.split(".")
+        container = nested
+        for part in parts[:-1]:
+            container = container.setdefault(part, {})
+        container[parts[-1]] = values.get(key)
+    return nested
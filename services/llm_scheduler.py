@@ -0,0 +1,412 @@
+"""Central scheduler for Claude calls.
+
+Every LLM call goes through `llm_scheduler.call`, which:
+  - orders waiting calls by priority class (interactive edits first, then form
+    generation, then background prefetch/bulk extraction), FIFO within a class;
+    a SharedPriority lets coalesced callers raise a call's class, even while it
+    is queued
+  - caps concurrent calls per class
+  - admits calls only when both the requests-per-minute and tokens-per-minute
+    token buckets have budget; background calls must also leave a reserve
+  - backs off adaptively on 429/529 responses: pauses admission for the
+    Retry-After period and scales the bucket rates down, recovering gradually
+    on success
+  - gives up once the current request's deadline (services.admission_service)
+    has passed, instead of queueing or retrying past it
+  - drops calls made inside a `cancel_scope` whose CancelToken was cancelled
+    before they were sent, even while they wait in the queue
+"""
+
+import contextvars
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from config import (
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+    LLM_MAX_CONCURRENT_INTERACTIVE,
+    LLM_MAX_CONCURRENT_STANDARD,
+    LLM_MAX_CONCURRENT_BACKGROUND,
+    LLM_BACKGROUND_RESERVE,
+    LLM_MAX_RETRIES,
+)
+from services.admission_service import DeadlineExceeded, current_deadline
+from services.metrics_service import REGISTRY
+from services.tracing_service import log_error
+
+INTERACTIVE = "interactive"
+STANDARD = "standard"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, STANDARD, BACKGROUND)
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    "harper_llm_queue_depth",
+    "LLM calls waiting for admission",
+    ["priority"],
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "harper_llm_in_flight",
+    "LLM calls currently running",
+    ["priority"],
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "harper_llm_queue_wait_seconds",
+    "Time LLM calls waited for admission",
+    ["priority"],
+)
+RATE_LIMITED = REGISTRY.counter(
+    "harper_llm_rate_limited_total",
+    "LLM calls rejected by the provider with 429/529",
+    ["priority"],
+)
+RETRIES = REGISTRY.counter(
+    "harper_llm_retries_total",
+    "LLM calls retried after a retryable error",
+    ["priority"],
+)
+RATE_FACTOR = REGISTRY.gauge(
+    "harper_llm_rate_factor",
+    "Current fraction of the configured request/token rates the scheduler admits (adaptive backoff)",
+)
+
+_RATE_LIMIT_STATUSES = {429, 529}
+_RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+_RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError"}
+
+# Adaptive backoff: multiplicative decrease on 429, additive recovery per success
+_MIN_RATE_FACTOR = 0.1
+_RATE_DECREASE = 0.5
+_RATE_RECOVERY = 0.05
+
+
+class SchedulerTimeout(DeadlineExceeded):
+    """Raised when a call could not be admitted before its deadline."""
+
+
+class CallCancelled(Exception):
+    """Raised when a call's CancelToken was cancelled before the call was sent."""
+
+
+class CancelToken:
+    """
+    Cancels the not-yet-sent LLM calls made inside `cancel_scope(token)`, e.g.
+    a background prefetch still waiting for admission.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cancelled = False
+        self.sent = False
+
+    def cancel(self) -> bool:
+        """Cancels; returns False if a call was already sent (it runs to completion)."""
+        with self._lock:
+            self.cancelled = True
+            return not self.sent
+
+    def _claim(self) -> bool:
+        # Marks a call as sent unless cancelled first
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.sent = True
+            return True
+
+
+_cancel_token: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar(
+    "harper_llm_cancel_token", default=None
+)
+
+
+@contextmanager
+def cancel_scope(token: CancelToken):
+    """LLM calls made inside the block are dropped once `token` is cancelled."""
+    reset = _cancel_token.set(token)
+    try:
+        yield token
+    finally:
+        _cancel_token.reset(reset)
+
+
+class TokenBucket:
+    """Continuously refilling bucket; `level` may go negative to record debt."""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = float(per_minute)
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def refill(self, now: float, factor: float) -> None:
+        rate = self.per_minute * factor / 60.0
+        capacity = self.per_minute * factor
+        self.level = min(capacity, self.level + (now - self._updated) * rate)
+        self._updated = now
+
+    def seconds_until(self, amount: float, factor: float) -> float:
+        missing = amount - self.level
+        if missing <= 0:
+            return 0.0
+        return missing / (self.per_minute * factor / 60.0)
+
+
+class SharedPriority:
+    """
+    Priority class shared by callers coalesced onto one piece of work (e.g. a
+    request joining a background prefetch). Raise it with
+    `llm_scheduler.upgrade`; calls made with it pick up the new class, and so
+    does one already waiting in the queue.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, priority: str):
+        self.value = priority
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "shared")
+
+    def __init__(self, priority: str, seq: int, tokens: int, shared: Optional[SharedPriority]):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.shared = shared
+
+    def rank(self):
+        return PRIORITIES.index(self.priority), self.seq
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LLMScheduler:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int,
+                 max_concurrent: Dict[str, int], background_reserve: float, max_retries: int):
+        self.max_concurrent = max_concurrent
+        self.background_reserve = background_reserve
+        self.max_retries = max_retries
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._rate_factor = 1.0
+        self._paused_until = 0.0
+        self._backoff_seconds = 1.0
+        self._running = {priority: 0 for priority in PRIORITIES}
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        RATE_FACTOR.set(self._rate_factor)
+
+    # Admission
+
+    def _next_eligible_locked(self) -> Optional[_Waiter]:
+        # Highest-priority waiter whose class still has a free concurrency slot
+        for waiter in sorted(self._queue, key=_Waiter.rank):
+            if self._running[waiter.priority] < self.max_concurrent[waiter.priority]:
+                return waiter
+        return None
+
+    def _admit_delay_locked(self, waiter: _Waiter, now: float) -> float:
+        """Seconds until `waiter` could be admitted; 0 means admit now."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._requests.refill(now, self._rate_factor)
+        self._tokens.refill(now, self._rate_factor)
+        needed_tokens = waiter.tokens
+        needed_requests = 1.0
+        if waiter.priority == BACKGROUND:
+            # Leave headroom so background work can't drain the budget interactive calls need
+            needed_tokens += self._tokens.per_minute * self._rate_factor * self.background_reserve
+            needed_requests += self._requests.per_minute * self._rate_factor * self.background_reserve
+        # Never ask for more than a bucket can hold, or the call would wait forever
+        # (e.g. the reserve on a small, backed-off requests bucket)
+        return max(
+            self._requests.seconds_until(min(needed_requests, self._requests.per_minute * self._rate_factor), self._rate_factor),
+            self._tokens.seconds_until(min(needed_tokens, self._tokens.per_minute * self._rate_factor), self._rate_factor),
+        )
+
+    def _acquire(self, priority: Union[str, SharedPriority], tokens: int, deadline: Optional[float],
+                 cancel: Optional[CancelToken] = None) -> str:
+        """Waits for admission; returns the class the call was admitted (and counted) under."""
+        started = time.monotonic()
+        with self._cond:
+            shared = priority if isinstance(priority, SharedPriority) else None
+            waiter = _Waiter(shared.value if shared else priority, next(self._seq), tokens, shared)
+            self._queue.append(waiter)
+            QUEUE_DEPTH.inc(priority=waiter.priority)
+            try:
+                while True:
+                    if cancel is not None and cancel.cancelled:
+                        raise CallCancelled(f"LLM call ({waiter.priority}) cancelled while queued")
+                    now = time.monotonic()
+                    timeout = None
+                    if self._next_eligible_locked() is waiter:
+                        delay = self._admit_delay_locked(waiter, now)
+                        if delay <= 0:
+                            if cancel is not None and not cancel._claim():
+                                raise CallCancelled(f"LLM call ({waiter.priority}) cancelled while queued")
+                            break
+                        timeout = delay
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            raise SchedulerTimeout(f"LLM call ({waiter.priority}) not admitted before its deadline")
+                        timeout = remaining if timeout is None else min(timeout, remaining)
+                    self._cond.wait(timeout)
+            finally:
+                self._queue.remove(waiter)
+                QUEUE_DEPTH.dec(priority=waiter.priority)
+                # Whoever is next may now be eligible
+                self._cond.notify_all()
+
+            priority = waiter.priority
+            self._requests.level -= 1
+            self._tokens.level -= tokens
+            self._running[priority] += 1
+        IN_FLIGHT.inc(priority=priority)
+        QUEUE_WAIT.observe(time.monotonic() - started, priority=priority)
+        return priority
+
+    def wake(self) -> None:
+        """Wakes queued calls so they notice a cancelled CancelToken."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def upgrade(self, shared: SharedPriority, priority: str) -> None:
+        """Raises `shared` to `priority` if that is higher, re-ranking its queued calls."""
+        if priority not in self.max_concurrent:
+            raise ValueError(f"Unknown LLM priority: {priority}")
+        with self._cond:
+            if PRIORITIES.index(priority) >= PRIORITIES.index(shared.value):
+                return
+            shared.value = priority
+            for waiter in self._queue:
+                if waiter.shared is shared:
+                    QUEUE_DEPTH.dec(priority=waiter.priority)
+                    QUEUE_DEPTH.inc(priority=priority)
+                    waiter.priority = priority
+            self._cond.notify_all()
+
+    def _release(self, priority: str, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """
+        Frees the call's slot and settles its estimate against `actual_tokens`
+        (refund or debt); None keeps the estimate charged.
+        """
+        with self._cond:
+            self._running[priority] -= 1
+            if actual_tokens is not None:
+                self._tokens.level += estimated_tokens - actual_tokens
+            self._cond.notify_all()
+        IN_FLIGHT.dec(priority=priority)
+
+    # Adaptive backoff
+
+    def _on_rate_limited(self, error: Exception) -> float:
+        with self._cond:
+            retry_after = _retry_after(error)
+            wait = retry_after if retry_after is not None else self._backoff_seconds
+            wait += random.uniform(0, 0.25 * wait)
+            self._paused_until = max(self._paused_until, time.monotonic() + wait)
+            self._backoff_seconds = min(self._backoff_seconds * 2, 60.0)
+            self._rate_factor = max(_MIN_RATE_FACTOR, self._rate_factor * _RATE_DECREASE)
+            RATE_FACTOR.set(self._rate_factor)
+            return wait
+
+    def _on_success(self) -> None:
+        with self._cond:
+            self._backoff_seconds = 1.0
+            if self._rate_factor < 1.0:
+                self._rate_factor = min(1.0, self._rate_factor + _RATE_RECOVERY)
+                RATE_FACTOR.set(self._rate_factor)
+
+    def call(self, priority: Union[str, SharedPriority], estimated_tokens: int, fn: Callable[[], Any],
+             usage_tokens: Callable[[Any], Optional[int]] = None, deadline: Optional[float] = None) -> Any:
+        """
+        Runs `fn` once admitted for `priority` (a class or a SharedPriority), retrying retryable provider errors
+        (up to LLM_MAX_RETRIES). `estimated_tokens` is charged against the token
+        bucket up front and settled with `usage_tokens(result)` afterwards.
+        `deadline` is a time.monotonic() timestamp after which waiting and retrying
+        give up; it defaults to the current request's deadline.
+        """
+        if (priority.value if isinstance(priority, SharedPriority) else priority) not in self.max_concurrent:
+            raise ValueError(f"Unknown LLM priority: {priority}")
+        if deadline is None:
+            deadline = current_deadline()
+        requested = priority
+        cancel = _cancel_token.get()
+        attempt = 0
+        while True:
+            # A SharedPriority may have been raised since the last attempt
+            priority = self._acquire(requested, estimated_tokens, deadline, cancel)
+            result = None
+            try:
+                result = fn()
+            except Exception as e:
+                # Failed calls (429/529, 5xx, connection errors) report no usage and are
+                # mostly not billed, so refund the estimate instead of holding the budget
+                self._release(priority, estimated_tokens, 0)
+                status = _status_code(e)
+                retryable = status in _RETRYABLE_STATUSES or type(e).__name__ in _RETRYABLE_ERRORS
+                if deadline is not None and time.monotonic() >= deadline:
+                    # Includes upstream timeouts cut short by the deadline
+                    raise DeadlineExceeded(f"LLM call ({priority}) ran past the request deadline") from e
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                RETRIES.inc(priority=priority)
+                if status in _RATE_LIMIT_STATUSES:
+                    RATE_LIMITED.inc(priority=priority)
+                    wait = self._on_rate_limited(e)
+                else:
+                    wait = min(2 ** attempt, 30) * random.uniform(0.5, 1.0)
+                    if deadline is not None and time.monotonic() + wait >= deadline:
+                        raise DeadlineExceeded(f"LLM call ({priority}) retry would run past the request deadline") from e
+                    time.sleep(wait)
+                log_error(f"llm_{priority}", f"{e} (retry {attempt}/{self.max_retries} in {wait:.1f}s)")
+                continue
+            actual = usage_tokens(result) if usage_tokens else None
+            self._release(priority, estimated_tokens, actual)
+            self._on_success()
+            return result
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    """Rough upper bound for a call: ~4 characters per input token plus the output limit."""
+    return len(prompt) // 4 + max_tokens
+
+
+def message_tokens(message: Any) -> Optional[int]:
+    """Input + output tokens of a Claude message, None if the response has no usage."""
+    usage = getattr(message, "usage", None)
+    if usage is None:
+        return None
+    return (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+
+
+llm_scheduler = LLMScheduler(
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+    {
+        INTERACTIVE: LLM_MAX_CONCURRENT_INTERACTIVE,
+        STANDARD: LLM_MAX_CONCURRENT_STANDARD,
+        BACKGROUND: LLM_MAX_CONCURRENT_BACKGROUND,
+    },
+    LLM_BACKGROUND_RESERVE,
+    LLM_MAX_RETRIES,
+)
@@ -3,20 +3,37 @@ Service for fetching companies and their memory/data from a data store or extern
 This version calls 'parse_and_clean_memory' to remove phone_events & md before returning.
 """
 
-import requests
-import os
+import httpx
 from config import (
     RETOOL_COMPANY_LIST_KEY,
     RETOOL_COMPANY_MEMORY_KEY,
     RETOOL_COMPANY_LIST_URL,
-    RETOOL_COMPANY_MEMORY_URL
+    RETOOL_COMPANY_MEMORY_URL,
+    HTTP_TIMEOUT_SECONDS
 )
 from services.parse_memory_service import parse_memory_data
 from services.clean_memory_service import clean_memory
+from services.admission_service import upstream_timeout
+from services.clients import get_http_client
+from services.singleflight import SingleFlight
+from services.tracing_service import trace_span, log_error
 
 def get_companies():
     """
     Fetch the list of companies by calling the Retool "company-query" endpoint.
+    Returns an empty list if the call fails.
+    """
+    try:
+        return fetch_companies()
+    except (httpx.HTTPError, ValueError) as e:
+        log_error("retool_company_list", e)
+        return []
+
+def fetch_companies():
+    """
+    Same as get_companies but raises httpx.HTTPError (or ValueError for a body
+    that isn't JSON) on failure, so callers that keep a cached copy can tell a
+    failed fetch from an empty list.
     """
     headers = {
         "Content-Type": "application/json",
@@ -24,20 +41,30 @@ def get_companies():
     }
     data = {}  # If the endpoint requires additional data, add it here
 
-    try:
-        response = requests.post(RETOOL_COMPANY_LIST_URL, json=data, headers=headers)
+    with trace_span("retool_company_list"):
+        response = get_http_client().post(
+            RETOOL_COMPANY_LIST_URL, json=data, headers=headers,
+            timeout=upstream_timeout(HTTP_TIMEOUT_SECONDS),
+        )
         response.raise_for_status()
         # The response should be a list of companies
         company_list = response.json()
-        return company_list
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching companies: {e}")
-        return []
+    return company_list
+
+# Parallel fetches of the same company's memory share one Retool call
+_memory_flight = SingleFlight("company_memory")
 
 def get_company_memory(company_id: int):
     """
     Fetch the memory/data for a specific company by calling the Retool "company-memory" endpoint,
     then parse & clean it to remove phone_events and md.
+    Concurrent calls for the same company_id are coalesced into one fetch.
+    """
+    return _memory_flight.do(company_id, _fetch_company_memory, company_id)
+
+def _fetch_company_memory(company_id: int):
+    """
+    Does the actual Retool fetch + clean for get_company_memory.
     """
     headers = {
         "Content-Type": "application/json",
@@ -48,14 +75,20 @@ def get_company_memory(company_id: int):
     }
 
     try:
-        response = requests.post(RETOOL_COMPANY_MEMORY_URL, json=data, headers=headers)
-        response.raise_for_status()
-        # Parse the raw memory JSON
-        memory_data = response.json()
+        with trace_span("retool_company_memory"):
+            response = get_http_client().post(
+                RETOOL_COMPANY_MEMORY_URL, json=data, headers=headers,
+                timeout=upstream_timeout(HTTP_TIMEOUT_SECONDS),
+            )
+            response.raise_for_status()
+            # Parse the raw memory JSON
+            memory_data = response.json()
         # Clean out phone_events & md
-        cleaned_data = clean_memory(memory_data)
+        with trace_span("clean_memory"):
+            cleaned_data = clean_memory(memory_data)
         return cleaned_data
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching company memory: {e}")
+    # ValueError: the response body wasn't valid JSON
+    except (httpx.HTTPError, ValueError) as e:
+        log_error("retool_company_memory", e)
         return {}
@@ -5,12 +5,144 @@ fields for PDF form filling.
 """
 
 import json
-import os
-from typing import Dict, Optional, Any
-from anthropic import Anthropic
+import threading
+from typing import Dict, List, Optional, Any, Tuple, Union
 from services.clean_memory_service import clean_memory
+from services.clients import get_anthropic_client
+from services.admission_service import DeadlineExceeded, upstream_timeout
+from services.extraction_cache import extraction_cache
+from services.provenance_service import provenance_store, memory_digests, changed_paths, is_stale
+from services.singleflight import SingleFlight, content_hash
+from services.llm_json import extract_json, validate_fields, nest_fields
+from services.llm_scheduler import (
+    llm_scheduler, estimate_tokens, message_tokens, CallCancelled, SharedPriority, STANDARD, BACKGROUND,
+)
+from services.metrics_service import REGISTRY
+from services.tracing_service import trace_span, record_error, log_error, record_llm_usage
+from config import EXTRACTION_REPAIR_ROUNDS, LLM_TIMEOUT_SECONDS
 
-def parse_memory_data(memory_data: Dict[str, Any], field_mapping: Dict[str, str] = None) -> Optional[Dict[str, Any]]:
+# Fields extracted for the ACORD 125 form when no field_mapping is given
+DEFAULT_FIELD_MAPPING = {
+    "billingPlanForPolicyIsDirect": "The billing plan for the policy (e.g. Agency, Direct)",
+    "applicantIsLLC": "The business entity type (e.g. Corporation, LLC, Partnership)",
+    "dateOfApplication": "The date of application in YYYY-MM-DD format",
+    "agency": "The agency name",
+    "carrier": "The insurance carrier name",
+    "naicCode": "The NAIC code",
+    "companyPolicyOrProgramName": "The company policy or program name",
+    "programCode": "The program code",
+    "agencyCustomerId": "The agency customer ID",
+    "hasBusinessOwnersAttachedSections": "Boolean indicating if business owners sections are attached",
+    "hasCommercialGeneralLiabilitySectionsAttached": "Boolean indicating if commercial general liability sections are attached",
+    "paymentPlan": "The payment plan",
+    "methodOfPayment": "The method of payment",
+    "audit1": "Audit information",
+    "applicantName1.firstName": "The first name of the main contact or applicant",
+    "applicantName1.mi": "The middle initial of the main contact or applicant",
+    "applicantName1.lastName": "The last name of the main contact or applicant", 
+    "glCode1": "The GL code",
+    "sic1": "The SIC code",
+    "naics1": "The NAICS code",
+    "feinOrSocSec1": "The FEIN or SSN",
+    "websiteAddress.street1": "Street address line 1 for the website address",
+    "websiteAddress.street2": "Street address line 2 for the website address",
+    "websiteAddress.city": "City for the website address",
+    "websiteAddress.state": "State for the website address",
+    "websiteAddress.zip": "ZIP code for the website address",
+    "websiteAddress.country": "Country for the website address",
+    "contactInformationPrimary1": "The primary contact information type",
+    "contactInformationSecondary1": "The secondary contact information type",
+    "premisesZipcode.street1": "Street address line 1 for the premises",
+    "premisesZipcode.street2": "Street address line 2 for the premises",
+    "premisesZipcode.city": "City for the premises",
+    "premisesZipcode.state": "State for the premises",
+    "premisesZipcode.zip": "ZIP code for the premises",
+    "premisesZipcode.country": "Country for the premises",
+    "agencyCustomerId1": "The agency customer ID (secondary)",
+    "location": "The location number",
+    "numberOfFullTimeEmployees": "The number of full-time employees",
+    "building": "The building number",
+    "county.street1": "Street address line 1 for the county",
+    "county.street2": "Street address line 2 for the county",
+    "county.city": "City for the county",
+    "county.state": "State for the county",
+    "county.zip": "ZIP code for the county",
+    "county.country": "Country for the county",
+    "location1": "The location number (secondary)",
+    "partTimeEmployeesNumber": "The number of part-time employees",
+    "building1": "The building number (secondary)",
+    "annualRevenues": "The annual revenues",
+    "location2": "The location number (tertiary)",
+    "building2": "The building number (tertiary)",
+    "location3": "The location number (quaternary)",
+    "building3": "The building number (quaternary)",
+    "descriptionOfPrimaryOperations": "Description of primary operations",
+    "agencyCustomerId2": "The agency customer ID (tertiary)",
+    "priorCarrierForGeneralLiability": "The prior carrier for general liability",
+    "priorCarrierForAutomobile": "The prior carrier for automobile",
+    "priorCarrierForProperty": "The prior carrier for property",
+    "agencyCustomerId3": "The agency customer ID (quaternary)",
+    "producersName": "The producer's name",
+    "depositAmount": "The deposit amount",
+    "minimumPremium": "The minimum premium",
+    "policyPremium": "The policy premium",
+    "hasEquipmentFloaterSectionsAttached": "Boolean indicating if equipment floater sections are attached",
+    "hasElectronicDataProcSectionAttached": "Boolean indicating if electronic data processing sections are attached",
+    "hasAccountsReceivableAttached": "Boolean indicating if accounts receivable sections are attached",
+    "hasBoilerAndMachinery": "Boolean indicating if boiler and machinery sections are attached",
+    "hasBusinessAuto": "Boolean indicating if business auto sections are attached",
+    "hasPropertySectionsAttached": "Boolean indicating if property sections are attached",
+    "hasTruckersMotorCarrierSectionsAttached": "Boolean indicating if truckers motor carrier sections are attached",
+    "hasTransportationSectionsAttached": "Boolean indicating if transportation sections are attached",
+    "policyNumber": "The policy number",
+    "agencyContactName": "The agency contact name",
+    "agencyContactPhone": "The agency contact phone",
+    "agencyEmailAddress": "The agency email address",
+    "proposedEffectiveDate": "The proposed effective date",
+    "billingPlanIsAgency": "Boolean indicating if billing plan is agency",
+    "field16f996340b2011f083dfd3961689d753": "Direct field",
+    "applicantIsNotForProfit": "Boolean indicating if applicant is not for profit",
+    "applicantContactName": "The applicant contact name",
+    "applicantPhoneNumber": "The applicant phone number",
+    "applicantEmailAddress": "The applicant email address",
+    "premisesState": "The premises state",
+    "hasFormalSafetyProgram": "Boolean indicating if there is a formal safety program",
+    "followsOsha": "Boolean indicating if OSHA guidelines are followed",
+    "hasSafetyPosition": "Boolean indicating if there is a safety position"
+}
+
+REPAIRED_FIELDS = REGISTRY.counter(
+    "harper_extraction_fields_repaired_total",
+    "Fields that were missing or invalid in the first extraction, by outcome of the targeted follow-up",
+    ["result"],
+)
+
+INCREMENTAL_FIELDS = REGISTRY.counter(
+    "harper_incremental_extraction_fields_total",
+    "Fields handled by incremental refreshes: reused from the previous extraction, re-extracted, or kept as manual edits",
+    ["result"],
+)
+
+# Output budget per extraction call; values plus their source paths
+_EXTRACTION_MAX_TOKENS = 2000
+
+# Concurrent extractions of the same company + memory + fields share one Claude call
+_extraction_flight = SingleFlight("extraction")
+# Priority of each in-flight extraction plus how many callers use it, so a request
+# that joins a background prefetch raises the prefetch's LLM calls to its own class
+_flight_priorities: Dict[str, List[Any]] = {}  # key -> [SharedPriority, callers]
+_flight_priorities_lock = threading.Lock()
+
+def extraction_key(company_id: Optional[int], cleaned_data: Dict[str, Any], field_mapping: Dict[str, str]) -> str:
+    """
+    Key identifying one extraction: company ID plus a hash of the cleaned memory and fields.
+    Used for both in-flight coalescing and the extraction cache.
+    """
+    return f"{company_id}:{content_hash([cleaned_data, field_mapping])}"
+
+def parse_memory_data(memory_data: Dict[str, Any], field_mapping: Dict[str, str] = None,
+                      company_id: Optional[int] = None, origin: str = "request",
+                      priority: Optional[str] = None) -> Optional[Dict[str, Any]]:
     """
     Uses Claude's reasoning capabilities to extract PDF form values from memory data.
     
@@ -18,104 +150,260 @@ def parse_memory_data(memory_data: Dict[str, Any], field_mapping: Dict[str, str]
         memory_data: The raw memory data dictionary
         field_mapping: Dictionary mapping field names to descriptions of what to look for
                        If None, uses a default set of fields
+        company_id: Used with a hash of the cleaned memory and fields to coalesce
+                    identical in-flight extractions and to look up cached results
+        origin: "prefetch" for speculative background runs, so cached results can
+                be attributed; leave as "request" otherwise
+        priority: LLM scheduler class; defaults to background for prefetches and
+                  standard otherwise
     
     Returns:
-        Properly structured data for PDF filling or None if required fields can't be found
+        Properly structured data for PDF filling (fields that couldn't be resolved are None),
+        or None if nothing could be extracted
     """
     # Set default field mapping if none provided
     if field_mapping is None:
-        field_mapping = {
-            "billingPlanForPolicyIsDirect": "The billing plan for the policy (e.g. Agency, Direct)",
-            "applicantIsLLC": "The business entity type (e.g. Corporation, LLC, Partnership)",
-            "dateOfApplication": "The date of application in YYYY-MM-DD format",
-            "agency": "The agency name",
-            "carrier": "The insurance carrier name",
-            "naicCode": "The NAIC code",
-            "companyPolicyOrProgramName": "The company policy or program name",
-            "programCode": "The program code",
-            "agencyCustomerId": "The agency customer ID",
-            "hasBusinessOwnersAttachedSections": "Boolean indicating if business owners sections are attached",
-            "hasCommercialGeneralLiabilitySectionsAttached": "Boolean indicating if commercial general liability sections are attached",
-            "paymentPlan": "The payment plan",
-            "methodOfPayment": "The method of payment",
-            "audit1": "Audit information",
-            "applicantName1.firstName": "The first name of the main contact or applicant",
-            "applicantName1.mi": "The middle initial of the main contact or applicant",
-            "applicantName1.lastName": "The last name of the main contact or applicant", 
-            "glCode1": "The GL code",
-            "sic1": "The SIC code",
-            "naics1": "The NAICS code",
-            "feinOrSocSec1": "The FEIN or SSN",
-            "websiteAddress.street1": "Street address line 1 for the website address",
-            "websiteAddress.street2": "Street address line 2 for the website address",
-            "websiteAddress.city": "City for the website address",
-            "websiteAddress.state": "State for the website address",
-            "websiteAddress.zip": "ZIP code for the website address",
-            "websiteAddress.country": "Country for the website address",
-            "contactInformationPrimary1": "The primary contact information type",
-            "contactInformationSecondary1": "The secondary contact information type",
-            "premisesZipcode.street1": "Street address line 1 for the premises",
-            "premisesZipcode.street2": "Street address line 2 for the premises",
-            "premisesZipcode.city": "City for the premises",
-            "premisesZipcode.state": "State for the premises",
-            "premisesZipcode.zip": "ZIP code for the premises",
-            "premisesZipcode.country": "Country for the premises",
-            "agencyCustomerId1": "The agency customer ID (secondary)",
-            "location": "The location number",
-            "numberOfFullTimeEmployees": "The number of full-time employees",
-            "building": "The building number",
-            "county.street1": "Street address line 1 for the county",
-            "county.street2": "Street address line 2 for the county",
-            "county.city": "City for the county",
-            "county.state": "State for the county",
-            "county.zip": "ZIP code for the county",
-            "county.country": "Country for the county",
-            "location1": "The location number (secondary)",
-            "partTimeEmployeesNumber": "The number of part-time employees",
-            "building1": "The building number (secondary)",
-            "annualRevenues": "The annual revenues",
-            "location2": "The location number (tertiary)",
-            "building2": "The building number (tertiary)",
-            "location3": "The location number (quaternary)",
-            "building3": "The building number (quaternary)",
-            "descriptionOfPrimaryOperations": "Description of primary operations",
-            "agencyCustomerId2": "The agency customer ID (tertiary)",
-            "priorCarrierForGeneralLiability": "The prior carrier for general liability",
-            "priorCarrierForAutomobile": "The prior carrier for automobile",
-            "priorCarrierForProperty": "The prior carrier for property",
-            "agencyCustomerId3": "The agency customer ID (quaternary)",
-            "producersName": "The producer's name",
-            "depositAmount": "The deposit amount",
-            "minimumPremium": "The minimum premium",
-            "policyPremium": "The policy premium",
-            "hasEquipmentFloaterSectionsAttached": "Boolean indicating if equipment floater sections are attached",
-            "hasElectronicDataProcSectionAttached": "Boolean indicating if electronic data processing sections are attached",
-            "hasAccountsReceivableAttached": "Boolean indicating if accounts receivable sections are attached",
-            "hasBoilerAndMachinery": "Boolean indicating if boiler and machinery sections are attached",
-            "hasBusinessAuto": "Boolean indicating if business auto sections are attached",
-            "hasPropertySectionsAttached": "Boolean indicating if property sections are attached",
-            "hasTruckersMotorCarrierSectionsAttached": "Boolean indicating if truckers motor carrier sections are attached",
-            "hasTransportationSectionsAttached": "Boolean indicating if transportation sections are attached",
-            "policyNumber": "The policy number",
-            "agencyContactName": "The agency contact name",
-            "agencyContactPhone": "The agency contact phone",
-            "agencyEmailAddress": "The agency email address",
-            "proposedEffectiveDate": "The proposed effective date",
-            "billingPlanIsAgency": "Boolean indicating if billing plan is agency",
-            "field16f996340b2011f083dfd3961689d753": "Direct field",
-            "applicantIsNotForProfit": "Boolean indicating if applicant is not for profit",
-            "applicantContactName": "The applicant contact name",
-            "applicantPhoneNumber": "The applicant phone number",
-            "applicantEmailAddress": "The applicant email address",
-            "premisesState": "The premises state",
-            "hasFormalSafetyProgram": "Boolean indicating if there is a formal safety program",
-            "followsOsha": "Boolean indicating if OSHA guidelines are followed",
-            "hasSafetyPosition": "Boolean indicating if there is a safety position"
-        }
+        field_mapping = DEFAULT_FIELD_MAPPING
     
     # Clean the memory data first
-    cleaned_data = clean_memory(memory_data)
+    with trace_span("clean_memory"):
+        cleaned_data = clean_memory(memory_data)
+    
+    if priority is None:
+        priority = BACKGROUND if origin == "prefetch" else STANDARD
+    
+    key = extraction_key(company_id, cleaned_data, field_mapping)
+    result = extraction_cache.get(key)
+    if result is None:
+        result = _coalesced_extraction(key, company_id, cleaned_data, field_mapping, origin, priority)
+    if origin != "prefetch":
+        # Counts a prefetch hit if a prefetch produced (or was producing) this result
+        extraction_cache.mark_used(key)
+    return result
+
+
+def _coalesced_extraction(key: str, company_id: Optional[int], cleaned_data: Dict[str, Any],
+                          field_mapping: Dict[str, str], origin: str, priority: str) -> Optional[Dict[str, Any]]:
+    with _flight_priorities_lock:
+        entry = _flight_priorities.setdefault(key, [SharedPriority(priority), 0])
+        entry[1] += 1
+    try:
+        # No-op unless we joined a lower-priority extraction (e.g. a prefetch)
+        llm_scheduler.upgrade(entry[0], priority)
+        return _extraction_flight.do(key, _extract_and_cache, key, company_id, cleaned_data, field_mapping, origin, entry[0])
+    finally:
+        with _flight_priorities_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _flight_priorities[key]
+
+
+def peek_extraction(memory_data: Dict[str, Any], field_mapping: Dict[str, str] = None,
+                    company_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Returns the cached result parse_memory_data would return for these arguments,
+    or None without calling Claude.
+    """
+    if field_mapping is None:
+        field_mapping = DEFAULT_FIELD_MAPPING
+    key = extraction_key(company_id, clean_memory(memory_data), field_mapping)
+    result = extraction_cache.get(key)
+    if result is not None:
+        extraction_cache.mark_used(key)
+    return result
+
+
+def refresh_extraction(memory_data: Dict[str, Any], field_mapping: Dict[str, str] = None,
+                       company_id: Optional[int] = None,
+                       priority: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], Dict[str, int]]:
+    """
+    Like parse_memory_data, but reuses the company's previous extraction: only fields
+    that were null, have no recorded source, or whose source memory paths changed
+    since then are sent to Claude. Fields the user edited by hand keep their manual
+    value and are never re-extracted.
+    
+    Returns the result in parse_memory_data's format and how many fields were
+    reused, re-extracted and kept as manual edits. Raises ValueError if the fields
+    that need re-extracting couldn't be extracted, rather than returning them blank.
+    """
+    if field_mapping is None:
+        field_mapping = DEFAULT_FIELD_MAPPING
+    if priority is None:
+        priority = STANDARD
+    
+    with trace_span("clean_memory"):
+        cleaned_data = clean_memory(memory_data)
+    
+    record = provenance_store.get(company_id) if company_id is not None else None
+    manual = {key: value for key, value in record.manual.items() if key in field_mapping} if record else {}
+    with trace_span("provenance_diff"):
+        changed = (changed_paths(record.digests, memory_digests(cleaned_data))
+                   if record and record.digests is not None else None)
     
+    values: Dict[str, Any] = {}
+    stale: Dict[str, str] = {}
+    for key, description in field_mapping.items():
+        if key in manual:
+            continue
+        # Unchanged memory reuses everything, nulls included
+        if changed is not None and key in record.values and (
+                not changed or not is_stale(record.values[key], record.sources.get(key), changed)):
+            values[key] = record.values[key]
+        else:
+            stale[key] = description
+    counts = {"reused": len(values), "reextracted": len(stale), "manual": len(manual)}
+    for outcome, count in counts.items():
+        INCREMENTAL_FIELDS.inc(count, result=outcome)
+    
+    if stale:
+        # Records provenance for the re-extracted fields against the new memory
+        extracted = parse_memory_data(memory_data, field_mapping=stale, company_id=company_id, priority=priority)
+        if extracted is not None:
+            fresh, invalid = validate_fields(extracted, stale)
+            values.update(fresh)
+            if len(stale) < len(field_mapping) and not invalid:
+                # Whole-mapping result for this memory, so a later full parse is a cache hit
+                extraction_cache.put(extraction_key(company_id, cleaned_data, field_mapping),
+                                     nest_fields(values, field_mapping), 0, "request")
+        else:
+            # Returning here would blank fields whose previous value is now stale
+            raise ValueError(f"Re-extraction of {len(stale)} fields failed")
+    
+    values.update(manual)
+    return nest_fields(values, field_mapping), counts
+
+
+def _extract_and_cache(key: str, company_id: Optional[int], cleaned_data: Dict[str, Any],
+                       field_mapping: Dict[str, str], origin: str,
+                       priority: Union[str, SharedPriority]) -> Optional[Dict[str, Any]]:
+    values, sources, tokens, complete = _extract_fields(cleaned_data, field_mapping, priority)
+    result = nest_fields(values, field_mapping) if values else None
+    if result is not None and company_id is not None:
+        provenance_store.record_extraction(company_id, memory_digests(cleaned_data), values, sources)
+    if result is not None and complete:
+        extraction_cache.put(key, result, tokens, origin)
+    elif origin == "prefetch":
+        # Not cached (nothing or only part recovered), so no request can ever use it
+        extraction_cache.record_wasted(tokens)
+    return result
+
+
+def _extract_fields(cleaned_data: Dict[str, Any], field_mapping: Dict[str, str],
+                    priority: Union[str, SharedPriority] = STANDARD) -> Tuple[Dict[str, Any], Dict[str, List[str]], int, bool]:
+    """
+    Runs the Claude extraction for `field_mapping` over already cleaned memory data.
+    
+    Fields that come back missing or malformed are re-requested on their own (up to
+    EXTRACTION_REPAIR_ROUNDS follow-up calls) and merged into the partial result, so a
+    single bad key costs a small follow-up instead of the whole extraction.
+    
+    Returns the resolved values by dotted key (empty if nothing could be extracted),
+    the memory paths each value came from, the number of tokens used and whether
+    every field was resolved.
+    """
+    tokens = 0
+    try:
+        content, tokens = _call_extraction(cleaned_data, field_mapping, "extraction", priority)
+    except (DeadlineExceeded, CallCancelled):
+        raise
+    except Exception as e:
+        log_error("extraction", e)
+        return {}, {}, tokens, False
+    
+    with trace_span("extraction_json_extract"):
+        parsed = extract_json(content)
+        values, invalid = validate_fields(parsed, field_mapping)
+        sources = _parse_sources(parsed, field_mapping)
+    
+    for _ in range(EXTRACTION_REPAIR_ROUNDS):
+        if not invalid:
+            break
+        record_error("extraction_validation", f"{len(invalid)} missing or invalid fields: {', '.join(invalid[:10])}")
+        # Targeted follow-up for just the fields that failed
+        subset = {key: field_mapping[key] for key in invalid}
+        try:
+            content, used = _call_extraction(cleaned_data, subset, "extraction_repair", priority)
+        except Exception as e:
+            # Includes DeadlineExceeded: keep the partial result rather than fail the request
+            log_error("extraction_repair", e)
+            break
+        tokens += used
+        with trace_span("extraction_json_extract"):
+            parsed = extract_json(content)
+            repaired, invalid = validate_fields(parsed, subset)
+            sources.update(_parse_sources(parsed, subset))
+        values.update(repaired)
+        REPAIRED_FIELDS.inc(len(repaired), result="repaired")
+    
+    if invalid:
+        REPAIRED_FIELDS.inc(len(invalid), result="unresolved")
+    return values, sources, tokens, bool(values) and not invalid
+
+
+def _parse_sources(parsed: Optional[Dict[str, Any]], field_mapping: Dict[str, str]) -> Dict[str, List[str]]:
+    """
+    Reads the "_sources" object of an extraction response: memory paths per field.
+    Accepts flat dotted keys or nested objects, and a single path or a list.
+    """
+    raw = parsed.get("_sources") if isinstance(parsed, dict) else None
+    if not isinstance(raw, dict):
+        return {}
+    sources: Dict[str, List[str]] = {}
+    for key in field_mapping:
+        paths = raw.get(key)
+        if paths is None and "." in key:
+            paths = raw
+            for part in key.split("."):
+                paths = paths.get(part) if isinstance(paths, dict) else None
+        if isinstance(paths, str):
+            paths = [paths]
+        if isinstance(paths, list):
+            paths = [path.strip() for path in paths if isinstance(path, str) and path.strip()]
+            if paths:
+                sources[key] = paths
+    return sources
+
+
+def _call_extraction(cleaned_data: Dict[str, Any], field_mapping: Dict[str, str], operation: str,
+                     priority: Union[str, SharedPriority]) -> Tuple[str, int]:
+    """
+    Sends one extraction prompt for `field_mapping` to Claude through the LLM scheduler.
+    Returns the response text and the number of tokens used.
+    """
+    with trace_span(f"{operation}_prompt_build"):
+        prompt = _build_extraction_prompt(cleaned_data, field_mapping)
+    
+    # Shared Anthropic client (raises ValueError if ANTHROPIC_API_KEY is not set)
+    client = get_anthropic_client()
+    
+    # Call Claude API (queued behind higher-priority calls and the provider rate limits)
+    with trace_span(f"{operation}_llm_call"):
+        message = llm_scheduler.call(
+            priority,
+            estimate_tokens(prompt, _EXTRACTION_MAX_TOKENS),
+            lambda: client.messages.create(
+                model="claude-3-sonnet-20240229",
+                max_tokens=_EXTRACTION_MAX_TOKENS,
+                temperature=0,
+                timeout=upstream_timeout(LLM_TIMEOUT_SECONDS),
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                system="You are an expert at extracting relevant information from JSON data for PDF form filling. You should only return valid JSON that matches the requested structure exactly."
+            ),
+            usage_tokens=message_tokens,
+        )
+    tokens = record_llm_usage(operation, prompt, message)
+    return message.content[0].text, tokens
+
+
+def _build_extraction_prompt(cleaned_data: Dict[str, Any], field_mapping: Dict[str, str]):
+    """
+    Builds the Claude extraction prompt for `field_mapping`.
+    """
     # Convert to JSON string for Claude API with proper escaping
     data_json = json.dumps(cleaned_data)
     
@@ -145,6 +433,9 @@ def parse_memory_data(memory_data: Dict[str, Any], field_mapping: Dict[str, str]
         child_dict = {child: "string or null" for child in children}
         output_structure[parent] = child_dict
     
+    # Last, so a truncated response loses source paths rather than values
+    output_structure["_sources"] = {key: ["path.in.data"] for key in list(field_mapping)[:2]}
+    
     # Convert to JSON string for the prompt
     output_example = json.dumps(output_structure, indent=4)
     
@@ -167,65 +458,12 @@ def parse_memory_data(memory_data: Dict[str, Any], field_mapping: Dict[str, str]
     - You need to reason about which fields make the most sense to use
     - The data structure might be different from case to case
     - Sometimes the data might be nested under company.json.company, other times elsewhere
+    - In "_sources", map every field you found (by its dotted name from the list above) to the
+      dotted path(s) in the JSON data the value came from, using numbers for list positions
+      (e.g. "company.json.locations.0.city"); leave out fields that are null
     
     Your response should be ONLY a JSON object with this structure:
     {output_example}
     """
     
-    # Get Anthropic API key
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if not api_key:
-        raise ValueError("ANTHROPIC_API_KEY environment variable not set")
-    
-    # Initialize Anthropic client
-    client = Anthropic(api_key=api_key)
-    
-    try:
-        # Call Claude API
-        message = client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=1000,
-            temperature=0,
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            system="You are an expert at extracting relevant information from JSON data for PDF form filling. You should only return valid JSON that matches the requested structure exactly."
-        )
-        
-        content = message.content[0].text
-        
-        # Extract the JSON part
-        if "```json" in content:
-            json_content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            json_content = content.split("```")[1].strip()
-        else:
-            json_content = content.strip()
-        
-        # Parse the extracted JSON
-        result = json.loads(json_content)
-        
-        # Validate the structure matches our expected output
-        for key in output_structure:
-            if key not in result:
-                print(f"Missing expected key: {key}")
-                return None
-            
-            if isinstance(output_structure[key], dict):
-                if not isinstance(result[key], dict):
-                    print(f"Expected {key} to be a dictionary")
-                    return None
-                
-                for child_key in output_structure[key]:
-                    if child_key not in result[key]:
-                        print(f"Missing expected key: {key}.{child_key}")
-                        return None
-        
-        return result
-    
-    except Exception as e:
-        print(f"Error with Claude API: {str(e)}")
-        return None
\ No newline at end of file
+    return prompt
@@ -0,0 +1,160 @@
+"""Service for speculative background extraction.
+
+Users almost always view a company's memory shortly before generating its
+form, so (when enabled) a memory fetch schedules a low-priority background
+`parse_memory_data` run whose result lands in the extraction cache. The later
+/forms/generate call then finds it warm, or joins it if it is still running.
+
+Prefetches are:
+  - cancellable (explicitly, or superseded by a newer prefetch for the same company)
+  - limited to PREFETCH_MAX_PENDING queued/running runs on PREFETCH_MAX_WORKERS threads
+  - limited by a global rolling-hour token budget (PREFETCH_TOKEN_BUDGET_PER_HOUR)
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from config import (
+    PREFETCH_MAX_WORKERS,
+    PREFETCH_MAX_PENDING,
+    PREFETCH_TOKEN_BUDGET_PER_HOUR,
+)
+from services.clean_memory_service import clean_memory
+from services.extraction_cache import extraction_cache
+from services.llm_scheduler import llm_scheduler, CallCancelled, CancelToken, cancel_scope
+from services.metrics_service import REGISTRY
+from services.parse_memory_service import (
+    DEFAULT_FIELD_MAPPING,
+    extraction_key,
+    parse_memory_data,
+    _extraction_flight,
+)
+from services.tracing_service import token_meter, log_error
+
+PREFETCHES = REGISTRY.counter(
+    "harper_prefetch_total",
+    "Speculative extractions by outcome",
+    ["outcome"],
+)
+PREFETCH_TOKENS = REGISTRY.counter(
+    "harper_prefetch_tokens_total",
+    "Tokens spent by speculative extractions",
+)
+
+_BUDGET_WINDOW_SECONDS = 3600.0
+
+
+class _Prefetch:
+    def __init__(self, key: str):
+        self.key = key
+        self.token = CancelToken()
+        self.future: Optional[Future] = None
+
+
+class PrefetchScheduler:
+    def __init__(self, max_workers: int, max_pending: int, token_budget: int):
+        self.max_pending = max_pending
+        self.token_budget = token_budget
+        self._max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Dict[Any, _Prefetch] = {}
+        self._spent: Deque[Tuple[float, int]] = deque()
+        self._lock = threading.Lock()
+
+    def _executor_locked(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="prefetch")
+        return self._executor
+
+    def _tokens_spent_locked(self, now: float) -> int:
+        while self._spent and self._spent[0][0] <= now - _BUDGET_WINDOW_SECONDS:
+            self._spent.popleft()
+        return sum(tokens for _, tokens in self._spent)
+
+    def schedule(self, company_id: int, memory_data: Dict[str, Any]) -> bool:
+        """
+        Schedules a background extraction for this company's memory.
+        Returns True if a prefetch was scheduled, False if it was skipped.
+        """
+        cleaned_data = clean_memory(memory_data)
+        key = extraction_key(company_id, cleaned_data, DEFAULT_FIELD_MAPPING)
+        if extraction_cache.contains(key) or _extraction_flight.in_flight(key):
+            PREFETCHES.inc(outcome="skipped_warm")
+            return False
+
+        with self._lock:
+            existing = self._pending.get(company_id)
+            if existing is not None:
+                if existing.key == key:
+                    PREFETCHES.inc(outcome="skipped_pending")
+                    return False
+                # Memory changed since the last prefetch; the old result would never be used
+                self._cancel_locked(company_id)
+            if len(self._pending) >= self.max_pending:
+                PREFETCHES.inc(outcome="skipped_queue_full")
+                return False
+            if self._tokens_spent_locked(time.monotonic()) >= self.token_budget:
+                PREFETCHES.inc(outcome="skipped_budget")
+                return False
+
+            prefetch = _Prefetch(key)
+            self._pending[company_id] = prefetch
+            prefetch.future = self._executor_locked().submit(self._run, company_id, prefetch, memory_data)
+        PREFETCHES.inc(outcome="scheduled")
+        return True
+
+    def _run(self, company_id: int, prefetch: _Prefetch, memory_data: Dict[str, Any]) -> None:
+        try:
+            if prefetch.token.cancelled:
+                return
+            # Cancelling stops the Claude calls until one is sent, even while queued for
+            # admission; requests that joined the extraction then run it themselves
+            with token_meter() as meter, cancel_scope(prefetch.token):
+                result = parse_memory_data(memory_data, company_id=company_id, origin="prefetch")
+            with self._lock:
+                self._spent.append((time.monotonic(), meter.tokens))
+            PREFETCH_TOKENS.inc(meter.tokens)
+            PREFETCHES.inc(outcome="completed" if result is not None else "failed")
+        except CallCancelled:
+            pass  # counted by _cancel_locked
+        except Exception as e:
+            PREFETCHES.inc(outcome="failed")
+            log_error("prefetch", e)
+        finally:
+            with self._lock:
+                if self._pending.get(company_id) is prefetch:
+                    del self._pending[company_id]
+
+    def _cancel_locked(self, company_id: int) -> bool:
+        prefetch = self._pending.pop(company_id, None)
+        if prefetch is None:
+            return False
+        stopped = prefetch.token.cancel()
+        if not (prefetch.future is None or prefetch.future.cancel() or not prefetch.future.running()):
+            # Running: its Claude call may still be waiting in the scheduler queue
+            llm_scheduler.wake()
+        PREFETCHES.inc(outcome="cancelled" if stopped else "cancel_too_late")
+        return stopped
+
+    def cancel(self, company_id: int) -> bool:
+        """
+        Cancels a prefetch for this company that hasn't sent its Claude call yet,
+        including one waiting for LLM admission. A prefetch whose call was already
+        sent runs to completion (other requests may be waiting on it).
+        """
+        with self._lock:
+            return self._cancel_locked(company_id)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for company_id in list(self._pending):
+                self._cancel_locked(company_id)
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+prefetch_scheduler = PrefetchScheduler(PREFETCH_MAX_WORKERS, PREFETCH_MAX_PENDING, PREFETCH_TOKEN_BUDGET_PER_HOUR)
@@ -0,0 +1,177 @@
+"""Field-level provenance for Claude extractions.
+
+For each company we keep a digest of every leaf of the cleaned memory the last
+extraction ran on (not the memory itself) and, per extracted field, its value and the memory paths Claude says it came from
+("company.json.locations.0.city"). When the memory changes, only fields whose
+source paths changed, that were null, or that have no known source need to be
+extracted again (see `parse_memory_service.refresh_extraction`).
+
+Manual edits made through the form endpoints are stored here too, so a refresh
+never overwrites a value the user set by hand.
+"""
+
+import copy
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from config import EXTRACTION_PROVENANCE_MAX_COMPANIES
+
+
+def flatten_memory(data: Any, prefix: str = "") -> Dict[str, Any]:
+    """
+    Flattens memory into {"dotted.path": leaf value}; list items use their index
+    ("locations.0.city"). Empty dicts/lists are kept as leaves.
+    """
+    if isinstance(data, dict) and data:
+        items = data.items()
+    elif isinstance(data, list) and data:
+        items = enumerate(data)
+    else:
+        return {prefix: data} if prefix else {}
+    leaves: Dict[str, Any] = {}
+    for key, value in items:
+        leaves.update(flatten_memory(value, f"{prefix}{key}" if not prefix else f"{prefix}.{key}"))
+    return leaves
+
+
+def memory_digests(data: Dict[str, Any]) -> Dict[str, str]:
+    """{"dotted.path": short hash of the leaf value} for cleaned memory."""
+    return {
+        path: hashlib.blake2b(json.dumps(value, sort_keys=True, default=str).encode("utf-8"), digest_size=8).hexdigest()
+        for path, value in flatten_memory(data).items()
+    }
+
+
+def changed_paths(old: Dict[str, str], new: Dict[str, str]) -> Set[str]:
+    """Leaf paths added, removed or modified between two memory_digests snapshots."""
+    return {
+        path for path in old.keys() | new.keys()
+        if path not in old or path not in new or old[path] != new[path]
+    }
+
+
+def _touches(source: str, changed: Set[str]) -> bool:
+    # A source covers its whole subtree, and a change above it replaces it
+    if source in changed:
+        return True
+    parts = source.split(".")
+    if any(".".join(parts[:i]) in changed for i in range(1, len(parts))):
+        return True
+    return any(path.startswith(source + ".") for path in changed)
+
+
+def is_stale(value: Any, sources: Optional[List[str]], changed: Set[str]) -> bool:
+    """
+    Whether a recorded field needs extracting again after `changed` paths moved:
+    it was null, Claude gave no source for it, or one of its sources changed.
+    """
+    if value is None or not sources:
+        return True
+    return any(_touches(source, changed) for source in sources)
+
+
+class ExtractionRecord:
+    __slots__ = ("digests", "values", "sources", "manual")
+
+    def __init__(self):
+        self.digests: Optional[Dict[str, str]] = None
+        self.values: Dict[str, Any] = {}
+        self.sources: Dict[str, List[str]] = {}
+        self.manual: Dict[str, Any] = {}
+
+    def snapshot(self) -> "ExtractionRecord":
+        # Shallow: `digests` and the source lists are replaced, never mutated in place
+        record = ExtractionRecord()
+        record.digests = self.digests
+        record.values = dict(self.values)
+        record.sources = dict(self.sources)
+        record.manual = dict(self.manual)
+        return record
+
+
+class ProvenanceStore:
+    """Per-company ExtractionRecords, least recently used companies evicted first."""
+
+    def __init__(self, max_companies: int):
+        self.max_companies = max_companies
+        self._records: "OrderedDict[Any, ExtractionRecord]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _record(self, company_id: Any) -> ExtractionRecord:
+        # Caller holds the lock
+        record = self._records.get(company_id)
+        if record is None:
+            record = self._records[company_id] = ExtractionRecord()
+            while len(self._records) > self.max_companies:
+                self._records.popitem(last=False)
+        self._records.move_to_end(company_id)
+        return record
+
+    def get(self, company_id: Any) -> Optional[ExtractionRecord]:
+        """Returns a snapshot of the company's record (treat it as read-only), or None."""
+        with self._lock:
+            record = self._records.get(company_id)
+            return record.snapshot() if record is not None else None
+
+    def record_extraction(self, company_id: Any, digests: Dict[str, str],
+                          values: Dict[str, Any], sources: Dict[str, List[str]]) -> None:
+        """
+        Stores freshly extracted dotted-key `values` and their `sources` for the
+        memory with `digests` (see memory_digests). If the memory changed since
+        the last extraction, recorded fields outside `values` that the change
+        made stale are dropped, so every field left in the record matches the
+        stored digests.
+        """
+        with self._lock:
+            record = self._record(company_id)
+            if record.digests is not None and record.digests != digests:
+                changed = changed_paths(record.digests, digests)
+                for key in list(record.values):
+                    if key not in values and is_stale(record.values[key], record.sources.get(key), changed):
+                        del record.values[key]
+                        record.sources.pop(key, None)
+            record.digests = digests
+            for key, value in values.items():
+                record.values[key] = value
+                record.sources[key] = list(sources.get(key, []))
+
+    def record_manual_edits(self, company_id: Any, values: Dict[str, Any]) -> None:
+        """Remembers values the user set by hand (dotted field keys)."""
+        with self._lock:
+            self._record(company_id).manual.update(copy.deepcopy(values))
+
+    def manual_edits(self, company_id: Any, keys: Iterable[str]) -> Dict[str, Any]:
+        """The company's manual edits for `keys` (keys without one are left out)."""
+        with self._lock:
+            record = self._records.get(company_id)
+            if record is None:
+                return {}
+            return {key: copy.deepcopy(record.manual[key]) for key in keys if key in record.manual}
+
+    def restore_manual_edits(self, company_id: Any, keys: Iterable[str], values: Dict[str, Any]) -> None:
+        """Sets the manual edits for `keys` back to `values`, forgetting keys missing from it."""
+        with self._lock:
+            manual = self._record(company_id).manual
+            for key in keys:
+                if key in values:
+                    manual[key] = values[key]
+                else:
+                    manual.pop(key, None)
+
+    def clear_manual_edits(self, company_id: Any, keys: Optional[Iterable[str]] = None) -> None:
+        """Forgets the company's manual edits (only `keys` if given)."""
+        with self._lock:
+            record = self._records.get(company_id)
+            if record is None:
+                return
+            if keys is None:
+                record.manual.clear()
+            else:
+                for key in keys:
+                    record.manual.pop(key, None)
+
+
+provenance_store = ProvenanceStore(EXTRACTION_PROVENANCE_MAX_COMPANIES)
@@ -0,0 +1,139 @@
+"""Helpers for large JSON responses.
+
+  - `project_fields` keeps only the requested dotted paths of a dict
+  - `fast_json_response` serializes a plain dict straight to bytes (orjson when
+    installed, stdlib json otherwise), bypassing FastAPI's per-field
+    jsonable_encoder pass, and compresses it (brotli when installed and
+    accepted, else gzip) once it exceeds RESPONSE_COMPRESSION_MIN_BYTES
+"""
+
+import gzip
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+from fastapi import Request, Response
+
+from config import RESPONSE_COMPRESSION_MIN_BYTES, RESPONSE_GZIP_LEVEL
+from services.metrics_service import REGISTRY, BYTE_BUCKETS
+from services.tracing_service import trace_span
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is used instead
+    brotli = None
+
+RESPONSE_BYTES = REGISTRY.histogram(
+    "harper_response_bytes",
+    "JSON response size before and after compression",
+    ["route", "stage"],
+    buckets=BYTE_BUCKETS,
+)
+
+_MISSING = object()
+
+
+def parse_paths(fields: Optional[str]) -> List[str]:
+    """Splits a comma-separated `fields` query value into dotted paths."""
+    if not fields:
+        return []
+    return [path.strip() for path in fields.split(",") if path.strip()]
+
+
+def _build_trie(paths: Iterable[str]) -> Dict[str, Any]:
+    """
+    Turns dotted paths into a nested dict of path parts; None marks a path's
+    end (take the whole value), so "a" wins over "a.b".
+    """
+    trie: Dict[str, Any] = {}
+    for path in paths:
+        node = trie
+        parts = path.split(".")
+        for i, part in enumerate(parts):
+            if part in node and node[part] is None:
+                break
+            if i == len(parts) - 1:
+                node[part] = None
+            else:
+                node = node.setdefault(part, {})
+    return trie
+
+
+def _project(value: Any, trie: Optional[Dict[str, Any]]) -> Any:
+    if trie is None:
+        return value
+    if isinstance(value, list):
+        # Every element is projected against all paths at once, so fields of one
+        # element are never mixed with another's ("locations.city", "locations.zip")
+        projected = [_project(item, trie) for item in value]
+        return [item for item in projected if item is not _MISSING]
+    if not isinstance(value, dict):
+        return _MISSING
+    selected = {}
+    for key, child_trie in trie.items():
+        if key in value:
+            child = _project(value[key], child_trie)
+            if child is not _MISSING:
+                selected[key] = child
+    return selected if selected else _MISSING
+
+
+def project_fields(data: Dict[str, Any], paths: Iterable[str]) -> Dict[str, Any]:
+    """
+    Returns only the parts of `data` named by dotted `paths`, keeping their
+    nesting (e.g. "company.json.address"). Paths through lists apply to every
+    element. Unknown paths are ignored; no paths returns `data` unchanged.
+    """
+    paths = list(paths)
+    if not paths:
+        return data
+    projected = _project(data, _build_trie(paths))
+    return projected if isinstance(projected, dict) else {}
+
+
+def dumps(payload: Any) -> bytes:
+    """Serializes a JSON-compatible payload to UTF-8 bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _accepted_encodings(request: Request) -> List[str]:
+    header = request.headers.get("accept-encoding", "")
+    accepted = []
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        if name:
+            accepted.append(name.strip().lower())
+    return accepted
+
+
+def fast_json_response(request: Request, payload: Any, route: str, status_code: int = 200,
+                       headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Builds a JSON response for a plain dict/list payload without FastAPI's
+    encoder pass, compressed when it is large enough and the client accepts it.
+    """
+    with trace_span(f"{route}_serialize"):
+        body = dumps(payload)
+    RESPONSE_BYTES.observe(len(body), route=route, stage="raw")
+
+    response_headers = {"Vary": "Accept-Encoding", **(headers or {})}
+    if len(body) >= RESPONSE_COMPRESSION_MIN_BYTES:
+        accepted = _accepted_encodings(request)
+        with trace_span(f"{route}_compress"):
+            if brotli is not None and "br" in accepted:
+                body = brotli.compress(body, quality=5)
+                response_headers["Content-Encoding"] = "br"
+            elif "gzip" in accepted:
+                body = gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+                response_headers["Content-Encoding"] = "gzip"
+    RESPONSE_BYTES.observe(len(body), route=route, stage="wire")
+
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=response_headers)
@@ -0,0 +1,106 @@
+"""Request coalescing ("single-flight") for expensive calls.
+
+When several callers ask for the same key at the same time (double clicks,
+several open tabs), only the first one runs the function; the others wait
+for it and receive a copy of its result (or its exception). Waiters give up
+at their own request deadline, and if the leader ran out of *its* deadline or
+was cancelled (a prefetch), waiters that still have time run the call again
+themselves.
+"""
+
+import copy
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable
+
+from services.admission_service import DeadlineExceeded, current_deadline
+from services.llm_scheduler import CallCancelled
+from services.metrics_service import REGISTRY
+
+SINGLEFLIGHT_CALLS = REGISTRY.counter(
+    "harper_singleflight_calls_total",
+    "Calls through a single-flight group; outcome=deduplicated means the caller shared an in-flight result",
+    ["group", "outcome"],
+)
+
+
+def content_hash(obj: Any) -> str:
+    """
+    Stable hash of a JSON-compatible object, independent of dict key order.
+    """
+    payload = json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key. Nothing is cached once the
+    leading call finishes; a later call with the same key runs again.
+    The leader keeps the object `fn` returned and waiters get deep copies of a
+    separate snapshot, unless `copy_result` is False (for immutable or shared
+    objects).
+    """
+
+    def __init__(self, name: str, copy_result: bool = True):
+        self.name = name
+        self.copy_result = copy_result
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self._calls[key] = call
+                else:
+                    call.waiters += 1
+            if leader:
+                break
+
+            SINGLEFLIGHT_CALLS.inc(group=self.name, outcome="deduplicated")
+            deadline = current_deadline()
+            if not call.done.wait(None if deadline is None else max(0.0, deadline - time.monotonic())):
+                with self._lock:
+                    call.waiters -= 1
+                raise DeadlineExceeded(f"Deadline passed waiting for an in-flight {self.name} call")
+            if isinstance(call.error, (DeadlineExceeded, CallCancelled)) and (deadline is None or time.monotonic() < deadline):
+                # The leader's deadline or cancellation, not ours: run it again (or join whoever already does)
+                continue
+            if call.error is not None:
+                raise call.error
+            # Callers may mutate what they get back (e.g. form state), so each gets its own copy
+            return copy.deepcopy(call.result) if self.copy_result else call.result
+
+        SINGLEFLIGHT_CALLS.inc(group=self.name, outcome="leader")
+        result = None
+        try:
+            result = fn(*args, **kwargs)
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+                waiters = call.waiters
+            # The leader's caller may start mutating `result` as soon as we return,
+            # so waiters copy from a snapshot taken before they are released
+            call.result = copy.deepcopy(result) if waiters and self.copy_result else result
+            call.done.set()
+
+    def in_flight(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._calls
@@ -0,0 +1,213 @@
+"""Service for lightweight request tracing.
+
+Provides:
+  - a request context (request ID + per-stage timings) carried in a contextvar
+  - `trace_span` to time a stage of the pipeline into a latency histogram
+  - `record_llm_usage` to record token counts and payload sizes of Claude calls
+  - `token_meter` to count the tokens spent by LLM calls made in a block
+  - `RequestTracingMiddleware` to propagate `X-Request-ID` and log slow requests
+"""
+
+import contextvars
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, List, Optional, Tuple
+
+from config import SLOW_REQUEST_THRESHOLD_MS
+from services.metrics_service import REGISTRY, BYTE_BUCKETS, TOKEN_BUCKETS
+
+logger = logging.getLogger("harper.tracing")
+
+REQUEST_ID_HEADER = "x-request-id"
+
+STAGE_DURATION = REGISTRY.histogram(
+    "harper_stage_duration_seconds",
+    "Duration of each pipeline stage",
+    ["stage"],
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "harper_stage_errors_total",
+    "Number of pipeline stages that raised or reported an error",
+    ["stage"],
+)
+REQUEST_DURATION = REGISTRY.histogram(
+    "harper_request_duration_seconds",
+    "Duration of HTTP requests",
+    ["method", "route", "status"],
+)
+LLM_TOKENS = REGISTRY.histogram(
+    "harper_llm_tokens",
+    "Tokens per LLM call",
+    ["operation", "direction"],
+    buckets=TOKEN_BUCKETS,
+)
+LLM_PAYLOAD_BYTES = REGISTRY.histogram(
+    "harper_llm_payload_bytes",
+    "Prompt and completion size per LLM call in bytes",
+    ["operation", "direction"],
+    buckets=BYTE_BUCKETS,
+)
+
+
+class RequestContext:
+    """Per-request trace: request ID plus the (stage, seconds) pairs recorded so far."""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+    def breakdown(self) -> str:
+        return ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in self.stages)
+
+
+_current_request: contextvars.ContextVar[Optional[RequestContext]] = contextvars.ContextVar(
+    "harper_request", default=None
+)
+
+
+class TokenMeter:
+    """Accumulates tokens of LLM calls made inside a `token_meter` block."""
+
+    def __init__(self):
+        self.tokens = 0
+
+
+_current_meter: contextvars.ContextVar[Optional[TokenMeter]] = contextvars.ContextVar(
+    "harper_token_meter", default=None
+)
+
+
+@contextmanager
+def token_meter():
+    """
+    Counts the tokens of LLM calls made by this thread/task inside the block.
+    Calls made elsewhere (e.g. an in-flight call this block only waited on) are not counted.
+    """
+    meter = TokenMeter()
+    token = _current_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _current_meter.reset(token)
+
+
+def current_request() -> Optional[RequestContext]:
+    return _current_request.get()
+
+
+def current_request_id() -> Optional[str]:
+    ctx = _current_request.get()
+    return ctx.request_id if ctx else None
+
+
+@contextmanager
+def trace_span(stage: str):
+    """
+    Times the wrapped block as `stage`, records it in the latency histogram and,
+    when inside a request, appends it to that request's breakdown.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_DURATION.observe(elapsed, stage=stage)
+        ctx = _current_request.get()
+        if ctx is not None:
+            ctx.stages.append((stage, elapsed))
+
+
+def log_error(stage: str, error: Any) -> None:
+    """
+    Logs a handled error with the current request ID. Use for errors raised
+    inside a `trace_span`, which already counted them.
+    """
+    logger.error("[%s] %s failed: %s", current_request_id() or "-", stage, error)
+
+
+def record_error(stage: str, error: Any) -> None:
+    """
+    Counts and logs an error that was detected outside of a `trace_span`
+    (e.g. a response that parsed fine but failed validation).
+    """
+    STAGE_ERRORS.inc(stage=stage)
+    log_error(stage, error)
+
+
+def record_llm_usage(operation: str, prompt: str, message: Any) -> int:
+    """
+    Records token counts and payload sizes of a Claude `messages.create` response.
+    Returns the total tokens used (input + output), 0 if the response has no usage.
+    """
+    LLM_PAYLOAD_BYTES.observe(len(prompt.encode("utf-8")), operation=operation, direction="input")
+    content = getattr(message, "content", None) or []
+    text = "".join(getattr(block, "text", "") or "" for block in content)
+    LLM_PAYLOAD_BYTES.observe(len(text.encode("utf-8")), operation=operation, direction="output")
+
+    usage = getattr(message, "usage", None)
+    if usage is None:
+        return 0
+    input_tokens = getattr(usage, "input_tokens", 0) or 0
+    output_tokens = getattr(usage, "output_tokens", 0) or 0
+    LLM_TOKENS.observe(input_tokens, operation=operation, direction="input")
+    LLM_TOKENS.observe(output_tokens, operation=operation, direction="output")
+    meter = _current_meter.get()
+    if meter is not None:
+        meter.tokens += input_tokens + output_tokens
+    return input_tokens + output_tokens
+
+
+class RequestTracingMiddleware:
+    """
+    ASGI middleware that assigns every request an ID (reusing an incoming
+    `X-Request-ID`), echoes it back, records the request duration and logs
+    requests slower than SLOW_REQUEST_THRESHOLD_MS with their stage breakdown.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name.decode("latin-1").lower() == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")[:128]
+                break
+        ctx = RequestContext(request_id or uuid.uuid4().hex)
+        token = _current_request.set(ctx)
+        status = {"code": 500}
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER.encode("latin-1"), ctx.request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            _current_request.reset(token)
+            elapsed = time.perf_counter() - ctx.started
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            REQUEST_DURATION.observe(
+                elapsed, method=scope.get("method", ""), route=route_path, status=str(status["code"])
+            )
+            if SLOW_REQUEST_THRESHOLD_MS and elapsed * 1000 >= SLOW_REQUEST_THRESHOLD_MS:
+                logger.warning(
+                    "[%s] slow request %s %s took %.1fms (%s)",
+                    ctx.request_id, scope.get("method", ""), scope.get("path", ""),
+                    elapsed * 1000, ctx.breakdown() or "no stages recorded",
+                )
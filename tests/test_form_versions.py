@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException
+
+import logic.form_generation
+from routers import forms
+
+
+@pytest.fixture
+def company(monkeypatch):
+    company_id = 4242
+    with forms.FORM_STATES_LOCK:
+        forms.FORM_STATES.pop(company_id, None)
+        state = forms.FORM_STATES[company_id]
+        state["current"] = {"agency": "A", "premisesZipcode": {"city": "Austin", "zip": "78701"}}
+        forms._record_change(state, None)
+    yield company_id
+    forms.FORM_STATES.pop(company_id, None)
+
+
+def _edit(monkeypatch, company_id, path, value, expected_version, concurrent=None):
+    """Applies one edit; `concurrent` (path, value) lands while the model call runs."""
+    def resolve(form, commands):
+        if concurrent is not None:
+            with forms.FORM_STATES_LOCK:
+                state = forms.FORM_STATES[company_id]
+                state["current"], diff = logic.form_generation.apply_form_operations(
+                    state["current"], [{"path": concurrent[0], "value": concurrent[1]}])
+                forms._record_change(state, set(diff))
+        return [{"path": path, "value": value, "command": 0}]
+
+    monkeypatch.setattr(logic.form_generation, "resolve_form_commands", resolve)
+    return forms._apply_commands(company_id, [f"set {path}"], expected_version)
+
+
+def test_paths_changed_since():
+    state = {"version": 0, "changes": []}
+    forms._record_change(state, None)
+    forms._record_change(state, {"agency"})
+    forms._record_change(state, {"premisesZipcode.city"})
+    assert forms._paths_changed_since(state, 3) == set()
+    assert forms._paths_changed_since(state, 1) == {"agency", "premisesZipcode.city"}
+    # The whole form was replaced after version 0
+    assert forms._paths_changed_since(state, 0) is None
+
+
+def test_paths_changed_since_untracked_version():
+    state = {"version": 0, "changes": []}
+    for _ in range(forms.MAX_TRACKED_CHANGES + 1):
+        forms._record_change(state, {"agency"})
+    assert forms._paths_changed_since(state, 0) is None
+
+
+def test_edit_on_other_field_is_rebased(monkeypatch, company):
+    result = _edit(monkeypatch, company, "agency", "B", 1, concurrent=("premisesZipcode.zip", "73301"))
+    assert result["rebased"] is True
+    assert result["version"] == 3
+    assert result["updatedFormData"]["agency"] == "B"
+    assert result["updatedFormData"]["premisesZipcode"]["zip"] == "73301"
+
+
+def test_edit_on_same_field_conflicts(monkeypatch, company):
+    with pytest.raises(HTTPException) as error:
+        _edit(monkeypatch, company, "agency", "B", 1, concurrent=("agency", "C"))
+    assert error.value.status_code == 409
+    assert error.value.detail["conflicting_paths"] == ["agency"]
+    assert forms.FORM_STATES[company]["current"]["agency"] == "C"
+    assert forms.FORM_STATES[company]["history"] == []
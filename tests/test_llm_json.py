@@ -0,0 +1,15 @@
+from services.llm_json import extract_json
+
+
+def test_extract_json_drops_trailing_commas():
+    assert extract_json('{"a": [1, 2,], "b": {"c": 3,},}') == {"a": [1, 2], "b": {"c": 3}}
+
+
+def test_extract_json_keeps_commas_inside_strings():
+    text = '{"note": "ends with ,}", "list": "a,]", "x": 1,}'
+    assert extract_json(text) == {"note": "ends with ,}", "list": "a,]", "x": 1}
+
+
+def test_extract_json_truncated_keeps_string_contents():
+    text = '```json\n{"note": "literal ,] here", "city": "Aus'
+    assert extract_json(text) == {"note": "literal ,] here"}
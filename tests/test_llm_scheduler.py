@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from services.admission_service import DeadlineExceeded
+from services.llm_scheduler import (
+    BACKGROUND,
+    INTERACTIVE,
+    STANDARD,
+    LLMScheduler,
+    SchedulerTimeout,
+    SharedPriority,
+)
+
+
+def _scheduler(requests_per_minute=6000, max_concurrent=1, max_retries=0):
+    return LLMScheduler(
+        requests_per_minute,
+        10 ** 9,
+        {INTERACTIVE: max_concurrent, STANDARD: max_concurrent, BACKGROUND: max_concurrent},
+        background_reserve=0.0,
+        max_retries=max_retries,
+    )
+
+
+def _start(fn):
+    thread = threading.Thread(target=fn, daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_queued(scheduler, count):
+    deadline = time.monotonic() + 2
+    while len(scheduler._queue) < count:
+        assert time.monotonic() < deadline, "calls never queued"
+        time.sleep(0.005)
+
+
+class _ProviderError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+
+def test_queued_calls_run_in_priority_order():
+    scheduler = _scheduler(requests_per_minute=600)  # one request per 0.1s
+    scheduler._requests.level = 0.0
+    order = []
+    threads = [
+        _start(lambda p=priority: scheduler.call(p, 1, lambda: order.append(p)))
+        for priority in (BACKGROUND, STANDARD, INTERACTIVE)
+    ]
+    for thread in threads:
+        thread.join(5)
+    assert order == [INTERACTIVE, STANDARD, BACKGROUND]
+
+
+def test_class_cap_holds_calls_of_that_class_only():
+    scheduler = _scheduler(max_concurrent=1)
+    release = threading.Event()
+    first = _start(lambda: scheduler.call(STANDARD, 1, release.wait))
+    while scheduler._running[STANDARD] == 0:
+        time.sleep(0.005)
+
+    second_ran = threading.Event()
+    second = _start(lambda: scheduler.call(STANDARD, 1, second_ran.set))
+    _wait_queued(scheduler, 1)
+    # Another class still gets through while STANDARD is at its cap
+    assert scheduler.call(INTERACTIVE, 1, lambda: "ok") == "ok"
+    assert not second_ran.is_set()
+
+    release.set()
+    first.join(2)
+    second.join(2)
+    assert second_ran.is_set()
+
+
+def test_rate_limit_pauses_then_recovers():
+    scheduler = _scheduler(max_retries=1)
+    attempts = []
+
+    def fn():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise _ProviderError(429, retry_after="0.1")
+        return "ok"
+
+    assert scheduler.call(STANDARD, 1, fn) == "ok"
+    assert attempts[1] - attempts[0] >= 0.1
+    # Halved on the 429, partly recovered by the success
+    assert scheduler._rate_factor == pytest.approx(0.55)
+
+
+def test_call_not_admitted_before_deadline_times_out():
+    scheduler = _scheduler(requests_per_minute=1)
+    scheduler._requests.level = 0.0
+    with pytest.raises(SchedulerTimeout):
+        scheduler.call(STANDARD, 1, lambda: "never", deadline=time.monotonic() + 0.05)
+    assert scheduler._queue == []
+
+
+def test_retry_backoff_does_not_sleep_past_deadline():
+    scheduler = _scheduler(max_retries=3)
+
+    def fn():
+        raise _ProviderError(500)
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        scheduler.call(STANDARD, 1, fn, deadline=time.monotonic() + 0.2)
+    assert time.monotonic() - started < 0.2
+
+
+def test_failed_call_refunds_token_estimate():
+    scheduler = _scheduler()
+    level = scheduler._tokens.level
+    with pytest.raises(_ProviderError):
+        scheduler.call(STANDARD, 5000, lambda: (_ for _ in ()).throw(_ProviderError(400)))
+    assert scheduler._tokens.level == pytest.approx(level, abs=1)
+
+
+def test_upgrade_moves_queued_call_to_higher_class():
+    scheduler = _scheduler(max_concurrent=1)
+    release = threading.Event()
+    blocker = _start(lambda: scheduler.call(BACKGROUND, 1, release.wait))
+    while scheduler._running[BACKGROUND] == 0:
+        time.sleep(0.005)
+
+    shared = SharedPriority(BACKGROUND)
+    ran = threading.Event()
+    waiter = _start(lambda: scheduler.call(shared, 1, ran.set))
+    _wait_queued(scheduler, 1)
+    assert not ran.wait(0.05)
+
+    scheduler.upgrade(shared, STANDARD)
+    assert ran.wait(1)
+    assert shared.value == STANDARD
+    # Upgrades never lower the class
+    scheduler.upgrade(shared, BACKGROUND)
+    assert shared.value == STANDARD
+
+    release.set()
+    blocker.join(2)
+    waiter.join(2)
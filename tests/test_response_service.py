@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip("fastapi")
+
+from services.response_service import project_fields
+
+
+def test_project_fields_keeps_list_elements_apart():
+    data = {"locations": [{"city": "Austin"}, {"zip": "78701"}]}
+    assert project_fields(data, ["locations.city", "locations.zip"]) == {
+        "locations": [{"city": "Austin"}, {"zip": "78701"}]
+    }
+
+
+def test_project_fields_sparse_nested_lists():
+    data = {"locations": [{"city": "A"}, {"city": "B", "zip": "2"}]}
+    assert project_fields(data, ["locations.city", "locations.zip"]) == {
+        "locations": [{"city": "A"}, {"city": "B", "zip": "2"}]
+    }
+    assert project_fields(data, ["locations.zip"]) == {"locations": [{"zip": "2"}]}
+
+
+def test_project_fields_shorter_path_wins():
+    data = {"company": {"json": {"address": "x", "name": "y"}}, "other": 1}
+    assert project_fields(data, ["company.json.name", "company"]) == {"company": data["company"]}
+    assert project_fields(data, []) is data
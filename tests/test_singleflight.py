@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from services.admission_service import DeadlineExceeded, run_with_deadline
+from services.singleflight import SingleFlight
+
+
+def _run_together(flight, callers):
+    """
+    Runs `callers` (callables taking the flight) in threads; the first one is
+    started alone so it becomes the leader for "key".
+    """
+    results = {}
+
+    def capture(name, caller):
+        try:
+            results[name] = caller(flight)
+        except Exception as e:
+            results[name] = e
+
+    threads = []
+    for name, caller in callers.items():
+        thread = threading.Thread(target=capture, args=(name, caller), daemon=True)
+        thread.start()
+        threads.append(thread)
+        while len(threads) == 1 and not flight.in_flight("key"):
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_waiters_get_their_own_copy():
+    flight = SingleFlight("test")
+
+    def fn():
+        time.sleep(0.1)
+        return {"fields": [1]}
+
+    results = _run_together(flight, {
+        "leader": lambda f: f.do("key", fn),
+        "waiter": lambda f: f.do("key", fn),
+    })
+    assert results["leader"] == results["waiter"] == {"fields": [1]}
+    assert results["leader"] is not results["waiter"]
+
+
+def test_waiters_receive_leader_error():
+    flight = SingleFlight("test")
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.1)
+        raise RuntimeError("upstream failed")
+
+    results = _run_together(flight, {
+        "leader": lambda f: f.do("key", fn),
+        "waiter": lambda f: f.do("key", fn),
+    })
+    assert isinstance(results["waiter"], RuntimeError)
+    assert len(calls) == 1
+
+
+def test_waiter_gives_up_at_its_deadline():
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def fn():
+        release.wait(2)
+        return "late"
+
+    def impatient(f):
+        try:
+            return run_with_deadline(0.05, f.do, "key", fn)
+        finally:
+            release.set()
+
+    results = _run_together(flight, {
+        "leader": lambda f: f.do("key", fn),
+        "waiter": impatient,
+    })
+    assert results["leader"] == "late"
+    assert isinstance(results["waiter"], DeadlineExceeded)
+
+
+def test_waiter_reruns_after_leader_deadline():
+    flight = SingleFlight("test")
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.1)
+            raise DeadlineExceeded("leader ran out of time")
+        return "fresh"
+
+    results = _run_together(flight, {
+        "leader": lambda f: f.do("key", fn),
+        "waiter": lambda f: run_with_deadline(5, f.do, "key", fn),
+    })
+    assert isinstance(results["leader"], DeadlineExceeded)
+    assert results["waiter"] == "fresh"
+    assert len(calls) == 2